@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import deque
+
+UNAVAILABLE = "ЕМИАС временно недоступен"
+
+
+class Unavailable(ValueError):
+    # EMIAS could not answer: connection error, timeout, 5xx or garbage.
+    # Errors EMIAS reports about the request itself stay plain ValueErrors.
+    def __init__(self, message=UNAVAILABLE):
+        super().__init__(message)
+
+
+class CircuitOpen(Unavailable):
+    pass
+
+
+class CircuitBreaker:
+    # Closed: calls go through and their outcomes are kept for `window`
+    # seconds; once at least min_calls of them failed at `threshold` rate or
+    # more, the circuit opens. Open: calls fail at once for `cooldown`
+    # seconds. Half-open: a single probe goes through; it closes the circuit
+    # if it succeeds and opens it again if not.
+    def __init__(self, threshold, min_calls, window, cooldown):
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.outcomes = deque()
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def rejecting(self):
+        with self.lock:
+            return (
+                self.state == "open"
+                and time.monotonic() - self.opened_at < self.cooldown
+            )
+
+    def allow(self):
+        with self.lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = "half-open"
+            if self.state == "half-open":
+                if self.probing:
+                    return False
+                self.probing = True
+            return True
+
+    def open(self, now):
+        self.state = "open"
+        self.opened_at = now
+        self.outcomes.clear()
+
+    def record(self, failed):
+        # Returns True when this outcome opened the circuit.
+        now = time.monotonic()
+        with self.lock:
+            if self.state == "half-open":
+                self.probing = False
+                if failed:
+                    self.open(now)
+                    return True
+                self.state = "closed"
+                return False
+            if self.state == "open":
+                # a call that started before the circuit opened
+                return False
+            self.outcomes.append((now, failed))
+            while self.outcomes[0][0] < now - self.window:
+                self.outcomes.popleft()
+            calls = len(self.outcomes)
+            failures = sum(failed for _, failed in self.outcomes)
+            if calls >= self.min_calls and failures >= self.threshold * calls:
+                self.open(now)
+                return True
+            return False
+
+
+class Breakers:
+    # One circuit per EMIAS method, created on first use.
+    def __init__(self, threshold, min_calls, window, cooldown):
+        self.settings = (threshold, min_calls, window, cooldown)
+        self.circuits = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, method):
+        with self.lock:
+            if method not in self.circuits:
+                self.circuits[method] = CircuitBreaker(*self.settings)
+            return self.circuits[method]
+
+    def rejecting(self, methods):
+        return any(self[method].rejecting() for method in methods)
@@ -0,0 +1,250 @@
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, has_request_context
+
+from app import app, metrics
+from app.breaker import Unavailable
+
+
+class MemoryBackend:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, stored_at):
+        evicted = 0
+        with self.lock:
+            self.entries[key] = (stored_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                evicted += 1
+        if evicted:
+            metrics.cache_evictions.inc(evicted, backend="memory")
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        with self.lock:
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                del self.entries[key]
+
+
+class SQLiteBackend:
+    # Shared by every worker process on the host. Values are stored as JSON;
+    # the oldest entries are evicted once the table grows past maxsize.
+    def __init__(self, path, maxsize):
+        self.path = path
+        self.maxsize = maxsize
+        self.local = threading.local()
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, stored_at REAL NOT NULL, value TEXT NOT NULL)"
+        )
+        self.connection().execute(
+            "CREATE INDEX IF NOT EXISTS ix_cache_stored_at ON cache (stored_at)"
+        )
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def get(self, key):
+        row = (
+            self.connection()
+            .execute("SELECT stored_at, value FROM cache WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def set(self, key, value, stored_at):
+        connection = self.connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO cache (key, stored_at, value) VALUES (?, ?, ?)",
+            (key, stored_at, json.dumps(value)),
+        )
+        evicted = connection.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+            "ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+            (self.maxsize,),
+        ).rowcount
+        if evicted > 0:
+            metrics.cache_evictions.inc(evicted, backend="sqlite")
+
+    def delete(self, key):
+        self.connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix):
+        # a range instead of LIKE, so that no character needs escaping
+        self.connection().execute(
+            "DELETE FROM cache WHERE key >= ? AND key < ?",
+            (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)),
+        )
+
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class EmiasCache:
+    def __init__(self, backend, ttls, default_ttl, stale_ttl):
+        self.backend = backend
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def key(self, method, args):
+        return ":".join(str(part) for part in (method,) + args)
+
+    def join(self, key):
+        # Single flight: concurrent misses of one key wait for the first
+        # caller (the leader) instead of all hitting EMIAS.
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+        return flight, leader
+
+    def land(self, key, flight):
+        with self.lock:
+            del self.flights[key]
+        flight.done.set()
+
+    def load(self, key, func, args):
+        flight, leader = self.join(key)
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = func(*args)
+            self.backend.set(key, flight.value, time.time())
+            return flight.value
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            self.land(key, flight)
+
+    def refresh(self, method, key, func, args):
+        with self.lock:
+            if key in self.flights:
+                return
+        metrics.cache_refreshes.inc(method=method)
+
+        def run():
+            try:
+                self.load(key, func, args)
+            except Exception as error:
+                app.logger.warning("cache refresh of %s failed: %s", key, error)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def record(self, method, result):
+        metrics.cache_requests.inc(method=method, result=result)
+        metrics.trace_event("cache", method=method, result=result)
+
+    def lookup(self, method, ttl, key, func, args):
+        # Returns (found, value, expired): a stale value is returned and
+        # refreshed; an entry past the stale window is only handed back as
+        # `expired`, for fallback().
+        entry = self.backend.get(key)
+        if entry is not None:
+            stored_at, value = entry
+            age = time.time() - stored_at
+            if age < ttl:
+                self.record(method, "hit")
+                return True, value, None
+            if age < ttl + self.stale_ttl:
+                self.record(method, "stale")
+                self.refresh(method, key, func, args)
+                return True, value, None
+        self.record(method, "miss")
+        return False, None, entry
+
+    def fallback(self, method, expired, error):
+        # While EMIAS is down (or its circuit is open) the last known good
+        # value is better than an error page; the request is marked stale.
+        if expired is None or not isinstance(error, Unavailable):
+            raise error
+        stored_at, value = expired
+        self.record(method, "fallback")
+        if has_request_context():
+            g.emias_stale_since = min(g.get("emias_stale_since", stored_at), stored_at)
+        return value
+
+    def cached(self, method):
+        ttl = self.ttls.get(method, self.default_ttl)
+
+        def decorator(func):
+            signature = inspect.signature(func)
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                # keyword arguments are keyed like positional ones
+                args = signature.bind(*args, **kwargs).args
+                key = self.key(method, args)
+                found, value, expired = self.lookup(method, ttl, key, func, args)
+                if found:
+                    return value
+                try:
+                    return self.load(key, func, args)
+                except Unavailable as error:
+                    return self.fallback(method, expired, error)
+
+            wrapper.invalidate = lambda *args: self.backend.delete(
+                self.key(method, args)
+            )
+            # drops every entry whose arguments start with args
+            wrapper.invalidate_prefix = lambda *args: self.backend.delete_prefix(
+                self.key(method, args) + ":"
+            )
+            return wrapper
+
+        return decorator
+
+
+def create_backend(config):
+    if config["EMIAS_CACHE_BACKEND"] == "sqlite":
+        return SQLiteBackend(config["EMIAS_CACHE_PATH"], config["EMIAS_CACHE_MAXSIZE"])
+    return MemoryBackend(config["EMIAS_CACHE_MAXSIZE"])
+
+
+cache = EmiasCache(
+    backend=create_backend(app.config),
+    ttls=app.config["EMIAS_CACHE_TTL"],
+    default_ttl=app.config["EMIAS_CACHE_DEFAULT_TTL"],
+    stale_ttl=app.config["EMIAS_CACHE_STALE_TTL"],
+)
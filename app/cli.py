@@ -0,0 +1,119 @@
+import logging
+from datetime import datetime
+
+import click
+from apscheduler.schedulers.blocking import BlockingScheduler
+from flask.cli import AppGroup
+
+from app import app, db, metrics
+from app.outbox import send_outbox
+from app.retention import archive_appointments
+from app.routes import appointments_page_query
+from app.watcher import active_watches, scheduler
+
+
+def query_plan(query):
+    sql = str(
+        query.statement.compile(
+            dialect=db.engine.dialect, compile_kwargs={"literal_binds": True}
+        )
+    )
+    with db.engine.connect() as connection:
+        if db.engine.dialect.name == "sqlite":
+            rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")
+            return "\n".join(row[-1] for row in rows)
+        # an almost empty table would be scanned sequentially anyway
+        connection.exec_driver_sql("SET enable_seqscan = off")
+        rows = connection.exec_driver_sql(f"EXPLAIN {sql}")
+        return "\n".join(row[0] for row in rows)
+
+
+@app.cli.command("check-query-plans")
+def check_query_plans():
+    """Check that the hot appointment queries use their indexes."""
+    checks = [
+        ("watcher", active_watches(), "ix_appointment_active_resource"),
+        # a later page of /user: the keyset predicate and the LIMIT
+        (
+            "/user",
+            appointments_page_query(1, "2030-01-01T00:00:00_1"),
+            "ix_appointment_active_user",
+        ),
+    ]
+    failed = False
+    for name, query, index in checks:
+        plan = query_plan(query)
+        used = index in plan
+        failed = failed or not used
+        click.echo(f"{name}: {'ok' if used else 'MISSING ' + index}")
+        click.echo(plan)
+    if failed:
+        raise SystemExit(1)
+
+
+watcher = AppGroup("watcher", help="Background EMIAS watcher.")
+
+
+@watcher.command("run")
+@click.option(
+    "--shard",
+    type=int,
+    default=lambda: app.config["WATCHER_SHARD"],
+    help="Index of this worker, from 0.",
+)
+@click.option(
+    "--shards",
+    type=int,
+    default=lambda: app.config["WATCHER_SHARDS"],
+    help="Number of watcher workers.",
+)
+@click.option("--once", is_flag=True, help="Run a single tick and exit.")
+@click.option(
+    "--metrics-port", type=int, help="Serve Prometheus metrics on this port."
+)
+def run_watcher(shard, shards, once, metrics_port):
+    """Poll EMIAS for the active appointments of this shard."""
+    if not 0 <= shard < shards:
+        raise click.BadParameter("expected 0 <= shard < shards", param_hint="--shard")
+    app.logger.setLevel(logging.INFO)
+    kwargs = {"shard": shard, "shards": shards}
+    if once:
+        click.echo(scheduler(**kwargs))
+        click.echo(send_outbox(**kwargs))
+        click.echo(archive_appointments(**kwargs))
+        return
+    if metrics_port:
+        metrics.serve(
+            metrics_port,
+            host=app.config["METRICS_HOST"],
+            token=app.config["METRICS_TOKEN"],
+        )
+    metrics.start()
+    sched = BlockingScheduler()
+    sched.add_job(
+        func=scheduler,
+        kwargs=kwargs,
+        trigger="interval",
+        seconds=app.config["WATCHER_INTERVAL"],
+        next_run_time=datetime.now(),
+    )
+    sched.add_job(
+        func=send_outbox,
+        kwargs=kwargs,
+        trigger="interval",
+        seconds=app.config["OUTBOX_INTERVAL"],
+    )
+    sched.add_job(
+        func=archive_appointments,
+        kwargs=kwargs,
+        trigger="interval",
+        seconds=app.config["ARCHIVE_INTERVAL"],
+    )
+    click.echo(f"watcher shard {shard} of {shards} started")
+    try:
+        sched.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+
+app.cli.add_command(watcher)
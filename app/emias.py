@@ -0,0 +1,161 @@
+import random
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app import app, metrics
+from app.breaker import Breakers, CircuitOpen, Unavailable
+from app.cache import cache
+
+EIP5ORCH_METHODS = {
+    "getSpecialitiesInfo",
+    "getDoctorsInfo",
+    "getAvailableResourceScheduleInfo",
+}
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+
+def check_error(r):
+    # Only server errors and rate limiting mean EMIAS is unavailable; any
+    # other 4xx is a bad request (or a wrong EMIAS_URL) and must not open
+    # the circuit.
+    if r.status_code >= 500 or r.status_code == 429:
+        raise Unavailable()
+    if r.status_code >= 400:
+        raise ValueError(f"ЕМИАС отклонил запрос: HTTP {r.status_code}")
+    try:
+        payload = r.json()
+    except ValueError:
+        raise Unavailable()
+    if isinstance(payload, dict) and "error" in payload:
+        raise ValueError(payload["error"]["message"])
+    return payload
+
+
+breakers = Breakers(
+    threshold=app.config["EMIAS_BREAKER_THRESHOLD"],
+    min_calls=app.config["EMIAS_BREAKER_MIN_CALLS"],
+    window=app.config["EMIAS_BREAKER_WINDOW"],
+    cooldown=app.config["EMIAS_BREAKER_COOLDOWN"],
+)
+
+
+@contextmanager
+def measure(method):
+    # Wraps every upstream call: fails fast while the method's circuit is
+    # open, feeds the outcome back into it and records the metrics.
+    circuit = breakers[method]
+    if not circuit.allow():
+        metrics.emias_calls.inc(method=method, outcome="rejected")
+        raise CircuitOpen()
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except Unavailable:
+        outcome = "unavailable"
+        raise
+    except ValueError:
+        outcome = "error"
+        raise
+    except Exception:
+        # anything but an error EMIAS reported about the request itself
+        outcome = "unavailable"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        if circuit.record(outcome == "unavailable"):
+            app.logger.warning("EMIAS circuit for %s is open", method)
+            metrics.emias_circuit_opened.inc(method=method)
+        metrics.emias_calls.inc(method=method, outcome=outcome)
+        metrics.emias_duration.observe(elapsed, method=method)
+        metrics.trace_event(
+            "upstream",
+            method=method,
+            outcome=outcome,
+            duration_ms=round(elapsed * 1000, 1),
+        )
+
+
+def patient_params(oms_number, birth_date):
+    return {"omsNumber": oms_number, "birthDate": birth_date.strftime("%Y-%m-%d")}
+
+
+class EmiasClient:
+    def __init__(self, url, pool_size, timeout, timeouts, retries, backoff):
+        self.url = url
+        self.timeout = timeout
+        self.timeouts = timeouts
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def endpoint(self, method):
+        if method in EIP5ORCH_METHODS:
+            return f"{self.url}/eip5orch?{method}"
+        return f"{self.url}/eip"
+
+    def post(self, method, payload):
+        timeout = self.timeouts.get(method, self.timeout)
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            try:
+                r = self.session.post(
+                    self.endpoint(method), json=payload, timeout=timeout
+                )
+            except requests.RequestException:
+                # connection errors and timeouts, but also responses cut
+                # short or that could not be decoded
+                if last_attempt:
+                    raise Unavailable()
+            else:
+                if last_attempt or r.status_code not in TRANSIENT_STATUSES:
+                    return r
+            metrics.emias_retries.inc(method=method)
+            # full jitter keeps retries from many threads from lining up
+            time.sleep(random.uniform(0, self.backoff * 2**attempt))
+
+    def call(self, method, params):
+        payload = {
+            "jsonrpc": "2.0",
+            "id": "" if method in EIP5ORCH_METHODS else 1,
+            "method": method,
+            "params": params,
+        }
+        with measure(method):
+            return check_error(self.post(method, payload))["result"]
+
+
+client = EmiasClient(
+    url=app.config["EMIAS_URL"],
+    pool_size=app.config["EMIAS_POOL_SIZE"],
+    timeout=app.config["EMIAS_TIMEOUT"],
+    timeouts=app.config["EMIAS_TIMEOUTS"],
+    retries=app.config["EMIAS_RETRIES"],
+    backoff=app.config["EMIAS_BACKOFF"],
+)
+
+
+# Per patient: EMIAS answers these by OMS number and birth date. Shared by
+# the pages and the watcher; invalidated when the patient edits the profile.
+@cache.cached("getSpecialitiesInfo")
+def get_specialities_info(oms_number, birth_date):
+    return client.call("getSpecialitiesInfo", patient_params(oms_number, birth_date))
+
+
+@cache.cached("getDoctorsInfo")
+def get_doctors_info(oms_number, birth_date, speciality_id):
+    return client.call(
+        "getDoctorsInfo",
+        {**patient_params(oms_number, birth_date), "specialityId": str(speciality_id)},
+    )
+
+
+def invalidate_patient(oms_number, birth_date):
+    get_specialities_info.invalidate(oms_number, birth_date)
+    get_doctors_info.invalidate_prefix(oms_number, birth_date)
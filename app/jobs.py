@@ -0,0 +1,17 @@
+from functools import wraps
+
+from app import app, db
+
+
+def app_job(func):
+    # Background jobs run outside of any request: each run gets its own app
+    # context and its session is removed when the run ends.
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            try:
+                return func(*args, **kwargs)
+            finally:
+                db.session.remove()
+
+    return wrapper
@@ -0,0 +1,104 @@
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+from hashlib import blake2b
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+MINUTE = timedelta(minutes=1)
+
+
+def to_minutes(moment):
+    return (moment - EPOCH) // MINUTE
+
+
+def from_minutes(minutes):
+    return EPOCH + timedelta(minutes=minutes)
+
+
+def slot_minutes(start_time):
+    # EMIAS sends fixed-format local times ("2022-01-24T08:30:00+03:00");
+    # slicing the fields is several times faster than strptime with %z.
+    day = date(int(start_time[0:4]), int(start_time[5:7]), int(start_time[8:10]))
+    return (
+        (day.toordinal() - EPOCH_ORDINAL) * 1440
+        + int(start_time[11:13]) * 60
+        + int(start_time[14:16])
+    )
+
+
+def match_slots(slots, appointments):
+    # slots are the sorted epoch minutes of one resource. For every
+    # appointment watching it, the earliest slot inside its window is found
+    # by binary search: O(appointments * log(slots)) instead of
+    # slots * appointments.
+    matches = []
+    for appointment in appointments:
+        i = bisect_left(slots, to_minutes(appointment.start_time))
+        if i < len(slots) and slots[i] <= to_minutes(appointment.end_time):
+            matches.append((appointment, from_minutes(slots[i])))
+    return matches
+
+
+class SlotUpdate:
+    # What a poll would change in a SlotSnapshot. The watcher applies it
+    # only once the matches it produced are committed, so a failed tick
+    # does not count its new slots as seen.
+    def __init__(self, snapshot, seen_at, changed, new_slots, digest, raw, slots):
+        self.snapshot = snapshot
+        self.seen_at = seen_at
+        self.previous_seen_at = snapshot.seen_at
+        self.changed = changed
+        self.new_slots = new_slots
+        self.digest = digest
+        self.raw = raw
+        self.slots = slots
+
+    def apply(self):
+        self.snapshot.seen_at = self.seen_at
+        if self.changed:
+            self.snapshot.digest = self.digest
+            self.snapshot.raw = self.raw
+            self.snapshot.slots = self.slots
+
+
+class SlotSnapshot:
+    # Last seen schedule of one watched resource: a content digest plus the
+    # slots as a sorted array of epoch minutes and their raw strings in the
+    # same order. diff() parses only the slots that were not there before.
+    def __init__(self):
+        self.digest = None
+        self.raw = []
+        self.slots = array("l")
+        self.seen_at = None
+
+    def diff(self, raw_slots, seen_at):
+        raw = sorted(set(raw_slots))
+        digest = blake2b("\n".join(raw).encode(), digest_size=16).digest()
+        if digest == self.digest:
+            return SlotUpdate(
+                self, seen_at, False, array("l"), digest, self.raw, self.slots
+            )
+        known = dict(zip(self.raw, self.slots))
+        new = {
+            start_time: slot_minutes(start_time)
+            for start_time in raw
+            if start_time not in known
+        }
+        known.update(new)
+        slots = sorted((known[start_time], start_time) for start_time in raw)
+        return SlotUpdate(
+            self,
+            seen_at,
+            True,
+            array("l", sorted(new.values())),
+            digest,
+            [start_time for _, start_time in slots],
+            array("l", (minutes for minutes, _ in slots)),
+        )
+
+    def update(self, raw_slots, seen_at):
+        # Returns (changed, new slots, seen_at of the previous update).
+        update = self.diff(raw_slots, seen_at)
+        update.apply()
+        return update.changed, update.new_slots, update.previous_seen_at
@@ -0,0 +1,371 @@
+import atexit
+import glob
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+from flask import g, has_request_context
+
+# Latency buckets in seconds, from a cached page up to a slow EMIAS call.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"),
+        )
+        for name, value in zip(labelnames, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Metric:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    @staticmethod
+    def combine(value, other):
+        return value + other
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield self.name, self.labelnames, key, value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            # one count per bucket plus one for values above the last bound
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                key: (list(counts), total)
+                for key, (counts, total) in self.values.items()
+            }
+
+    @staticmethod
+    def combine(value, other):
+        return [a + b for a, b in zip(value[0], other[0])], value[1] + other[1]
+
+    def samples(self, values):
+        labelnames = self.labelnames + ("le",)
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else repr(float(bound))
+                yield f"{self.name}_bucket", labelnames, key + (le,), cumulative
+            yield f"{self.name}_count", self.labelnames, key, cumulative
+            yield f"{self.name}_sum", self.labelnames, key, total
+
+
+class Registry:
+    # Metrics live in the memory of one process. With a MultiprocessStore,
+    # every process also writes them to a file of its own and render()
+    # adds up the files of all processes sharing the directory.
+    def __init__(self):
+        self.metrics = []
+        self.store = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def snapshot(self):
+        return {
+            metric.name: [
+                [list(key), value] for key, value in metric.snapshot().items()
+            ]
+            for metric in self.metrics
+        }
+
+    def render(self):
+        if self.store is None:
+            snapshots = {metric.name: metric.snapshot() for metric in self.metrics}
+        else:
+            snapshots = self.store.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            values = snapshots.get(metric.name, {})
+            for name, labelnames, key, value in metric.samples(values):
+                lines.append(f"{name}{format_labels(labelnames, key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class MultiprocessStore:
+    # Web workers each answer only some scrapes, so on their own every
+    # scrape would see another worker's counters. Each process writes its
+    # totals to <directory>/<pid>-<random>.json every `interval` seconds
+    # (and at exit); collect() sums all files. Files of exited processes
+    # are kept so that counters never go back; empty the directory when
+    # the whole service restarts.
+    def __init__(self, registry, directory, interval):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self.pid = None
+        self.path = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        # Called on every request; does the work once per process, so that
+        # workers forked from a preloaded app get their own file and thread.
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            if self.pid is not None:
+                # forked: the parent's values are already in its own file
+                for metric in self.registry.metrics:
+                    with metric.lock:
+                        metric.values.clear()
+            self.pid = os.getpid()
+            self.path = os.path.join(
+                self.directory, f"{self.pid}-{uuid.uuid4().hex[:8]}.json"
+            )
+        os.makedirs(self.directory, exist_ok=True)
+        self.flush()
+        threading.Thread(target=self.run, daemon=True).start()
+        atexit.register(self.flush)
+
+    def run(self):
+        pid = os.getpid()
+        while self.pid == pid:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        if self.pid != os.getpid():
+            return
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as file:
+            json.dump(self.registry.snapshot(), file)
+        os.replace(temporary, self.path)
+
+    def collect(self):
+        self.start()
+        self.flush()
+        metrics = {metric.name: metric for metric in self.registry.metrics}
+        totals = {name: {} for name in metrics}
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for name, entries in snapshot.items():
+                if name not in metrics:
+                    continue
+                values = totals[name]
+                for key, value in entries:
+                    key = tuple(key)
+                    values[key] = (
+                        metrics[name].combine(values[key], value)
+                        if key in values
+                        else value
+                    )
+        return totals
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "Time spent handling a request, by view.",
+    ("endpoint", "method", "status"),
+)
+emias_calls = registry.counter(
+    "emias_calls_total",
+    "EMIAS JSON-RPC calls, by method and outcome (ok, error, unavailable or "
+    "rejected by an open circuit).",
+    ("method", "outcome"),
+)
+emias_duration = registry.histogram(
+    "emias_call_duration_seconds",
+    "EMIAS JSON-RPC call latency including retries, by method.",
+    ("method",),
+)
+emias_circuit_opened = registry.counter(
+    "emias_circuit_opened_total",
+    "Times the circuit breaker of an EMIAS method opened.",
+    ("method",),
+)
+emias_retries = registry.counter(
+    "emias_retries_total", "EMIAS requests retried, by method.", ("method",)
+)
+cache_requests = registry.counter(
+    "emias_cache_requests_total",
+    "Cached EMIAS lookups, by method and result (hit, stale, miss or fallback "
+    "to an expired entry while EMIAS is unavailable).",
+    ("method", "result"),
+)
+cache_refreshes = registry.counter(
+    "emias_cache_refreshes_total",
+    "Stale EMIAS cache entries refreshed in the background, by method.",
+    ("method",),
+)
+cache_evictions = registry.counter(
+    "emias_cache_evictions_total",
+    "EMIAS cache entries evicted to stay under EMIAS_CACHE_MAXSIZE, by backend.",
+    ("backend",),
+)
+watcher_tick_duration = registry.histogram(
+    "watcher_tick_duration_seconds", "Duration of a watcher tick."
+)
+watcher_appointments = registry.counter(
+    "watcher_appointments_checked_total",
+    "Active appointments checked against a fresh schedule.",
+)
+watcher_matches = registry.counter(
+    "watcher_appointments_matched_total", "Appointments a free slot was found for."
+)
+emails = registry.counter(
+    "outbox_emails_total",
+    "Notification emails, by result (sent or failed).",
+    ("result",),
+)
+
+
+trace_logger = logging.getLogger("app.trace")
+
+
+def enable_traces():
+    # One JSON line per request on stderr, apart from the app's own log.
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.addHandler(handler)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+
+def trace_event(kind, **event):
+    # Attaches an upstream call or a cache lookup to the current request's
+    # trace; work done outside a request (watcher, prefetch threads) is only
+    # counted in the metrics.
+    if has_request_context() and "trace" in g:
+        g.trace.setdefault(kind, []).append(event)
+
+
+def use_directory(directory, interval):
+    registry.store = MultiprocessStore(registry, directory, interval)
+
+
+def start():
+    if registry.store is not None:
+        registry.store.start()
+
+
+def start_request():
+    start()
+    g.trace = {"started": time.perf_counter()}
+
+
+def finish_request(request, response):
+    # For streamed responses this is the time to the first byte.
+    if "trace" not in g:
+        return
+    elapsed = time.perf_counter() - g.trace.pop("started")
+    endpoint = request.endpoint or "unmatched"
+    request_duration.observe(
+        elapsed, endpoint=endpoint, method=request.method, status=response.status_code
+    )
+    if trace_logger.isEnabledFor(logging.INFO):
+        trace_logger.info(
+            json.dumps(
+                {
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "method": request.method,
+                    "path": request.path,
+                    "endpoint": endpoint,
+                    "status": response.status_code,
+                    "duration_ms": round(elapsed * 1000, 1),
+                    **g.trace,
+                },
+                ensure_ascii=False,
+            )
+        )
+
+
+def authorized(authorization, token):
+    # without a token /metrics is open; with one it wants "Bearer <token>"
+    if not token:
+        return True
+    return hmac.compare_digest(
+        (authorization or "").encode(), f"Bearer {token}".encode()
+    )
+
+
+def make_wsgi_app(token=None):
+    def wsgi_app(environ, start_response):
+        if not authorized(environ.get("HTTP_AUTHORIZATION"), token):
+            start_response("401 Unauthorized", [("Content-Type", "text/plain")])
+            return [b"Unauthorized"]
+        start_response("200 OK", [("Content-Type", CONTENT_TYPE)])
+        return [registry.render().encode()]
+
+    return wsgi_app
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1", token=None):
+    # For processes without a web server of their own, like the watcher.
+    start()
+    server = make_server(host, port, make_wsgi_app(token), handler_class=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,11 +1,16 @@
+import threading
 from email.policy import default
 from enum import unique
 from datetime import datetime
 from venv import create
-from app import db
+
+from cachetools import TTLCache
+from sqlalchemy.orm import make_transient_to_detached
+
+from app import app, db
 from flask_login import UserMixin
 from app import login
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.passwords import hasher
 
 
 class User(UserMixin, db.Model):
@@ -20,15 +25,48 @@ class User(UserMixin, db.Model):
         return f"<User {self.oms_number}>"
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return hasher.needs_rehash(self.password_hash)
+
+
+# Column values of recently loaded users, so that authenticated requests do
+# not each select their user. Entries expire after USER_CACHE_TTL seconds and
+# are dropped when the profile changes.
+user_cache = TTLCache(
+    maxsize=app.config["USER_CACHE_MAXSIZE"], ttl=app.config["USER_CACHE_TTL"]
+)
+user_cache_lock = threading.Lock()
+
+
+def forget_user(id):
+    with user_cache_lock:
+        user_cache.pop(int(id), None)
 
 
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    id = int(id)
+    with user_cache_lock:
+        row = user_cache.get(id)
+    if row is None:
+        user = User.query.get(id)
+        if user is not None:
+            with user_cache_lock:
+                user_cache[id] = {
+                    column.key: getattr(user, column.key)
+                    for column in User.__table__.columns
+                }
+        return user
+    # merge(load=False) attaches it to this request's session without a
+    # query, so the profile can still be edited and committed
+    user = User(**row)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
 
 
 class Appointment(db.Model):
@@ -40,7 +78,83 @@ class Appointment(db.Model):
     end_time = db.Column(db.DateTime, nullable=False)
     status = db.Column(db.Boolean, default=True, nullable=False)
     created_date = db.Column(db.DateTime, default=datetime.now)
+    matched_slot = db.Column(db.DateTime)
+    matched_date = db.Column(db.DateTime)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
 
+    # Partial indexes over active watches only: the watcher reads them by
+    # resource, the /user page by patient; a patient has one active watch
+    # per doctor and window.
+    __table_args__ = (
+        db.Index(
+            "ix_appointment_active_resource",
+            "speciality_id",
+            "available_resource_id",
+            sqlite_where=db.text("status = 1"),
+            postgresql_where=db.text("status"),
+        ),
+        db.Index(
+            "ix_appointment_active_user",
+            "user_id",
+            "start_time",
+            "id",
+            sqlite_where=db.text("status = 1"),
+            postgresql_where=db.text("status"),
+        ),
+        db.Index(
+            "ix_appointment_active_window",
+            "user_id",
+            "available_resource_id",
+            "start_time",
+            "end_time",
+            unique=True,
+            sqlite_where=db.text("status = 1"),
+            postgresql_where=db.text("status"),
+        ),
+    )
+
     def __repr__(self):
         return f"<Appointment {self.doctor}>"
+
+
+class ArchivedAppointment(db.Model):
+    # Expired and fulfilled watches moved out of appointment by
+    # app.retention. appointment_id is the id they had there; SQLite may
+    # hand it to a new watch once the row is gone, so it is not unique.
+    __tablename__ = "appointment_archive"
+    id = db.Column(db.Integer, primary_key=True)
+    appointment_id = db.Column(db.Integer, nullable=False)
+    available_resource_id = db.Column(db.Integer, nullable=False)
+    speciality_id = db.Column(db.Integer, nullable=False)
+    doctor = db.Column(db.String, nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.Boolean, nullable=False)
+    created_date = db.Column(db.DateTime)
+    matched_slot = db.Column(db.DateTime)
+    matched_date = db.Column(db.DateTime)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), index=True)
+    archived_date = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+    def __repr__(self):
+        return f"<ArchivedAppointment {self.doctor}>"
+
+
+class Notification(db.Model):
+    # Outbox row: written by the watcher, delivered by app.outbox.
+    id = db.Column(db.Integer, primary_key=True)
+    appointment_id = db.Column(db.Integer, index=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(120), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(16), default="pending", nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    last_error = db.Column(db.String)
+    created_date = db.Column(db.DateTime, default=datetime.now)
+    sent_date = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index("ix_notification_due", "status", "next_attempt_at"),)
+
+    def __repr__(self):
+        return f"<Notification {self.recipient} {self.status}>"
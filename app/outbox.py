@@ -0,0 +1,185 @@
+import random
+import smtplib
+import ssl
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from app import app, db, metrics
+from app.jobs import app_job
+from app.models import Notification
+
+
+def enqueue_notifications(matches):
+    # matches pair watcher rows (see watcher.active_watches) with their slot.
+    # Only adds the rows; they are committed together with the status flip.
+    db.session.bulk_insert_mappings(
+        Notification,
+        [
+            {
+                "appointment_id": appointment.id,
+                "recipient": appointment.email,
+                "subject": "Новая запись",
+                "body": f"Появилась доступная запись. Проверьте на сайте ЕМИАС.\nЗапись: {appointment.doctor}\t{time_slot}",
+                "status": "pending",
+                "attempts": 0,
+                "next_attempt_at": datetime.now(),
+                "created_date": datetime.now(),
+            }
+            for appointment, time_slot in matches
+        ],
+    )
+
+
+class OutboxSender:
+    def __init__(
+        self,
+        server,
+        port,
+        use_ssl,
+        use_tls,
+        username,
+        password,
+        sender,
+        batch_size,
+        concurrency,
+        max_attempts,
+        backoff,
+    ):
+        self.server = server
+        self.port = port
+        self.use_ssl = use_ssl
+        self.use_tls = use_tls
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def connect(self):
+        if self.use_ssl:
+            server = smtplib.SMTP_SSL(
+                self.server, self.port, context=ssl.create_default_context()
+            )
+        else:
+            server = smtplib.SMTP(self.server, self.port)
+            if self.use_tls:
+                server.starttls(context=ssl.create_default_context())
+        if self.username:
+            server.login(self.username, self.password)
+        return server
+
+    def message(self, notification):
+        msg = EmailMessage()
+        msg["Subject"] = notification["subject"]
+        msg["From"] = self.sender
+        msg["To"] = notification["recipient"]
+        msg.set_content(notification["body"])
+        return msg
+
+    def send_chunk(self, notifications):
+        # One authenticated connection for the whole chunk; reconnects once
+        # if the server drops it halfway.
+        results = {}
+        server = None
+        try:
+            for notification in notifications:
+                for attempt in range(2):
+                    try:
+                        if server is None:
+                            server = self.connect()
+                        server.send_message(self.message(notification))
+                        results[notification["id"]] = None
+                        break
+                    except smtplib.SMTPServerDisconnected as error:
+                        server = None
+                        results[notification["id"]] = str(error)
+                    except smtplib.SMTPRecipientsRefused as error:
+                        results[notification["id"]] = str(error)
+                        break
+                    except (smtplib.SMTPException, OSError) as error:
+                        results[notification["id"]] = str(error)
+                        if server is not None:
+                            server.close()
+                            server = None
+                        break
+        finally:
+            if server is not None:
+                try:
+                    server.quit()
+                except (smtplib.SMTPException, OSError):
+                    pass
+        return results
+
+    def send_pending(self, shard=0, shards=1):
+        now = datetime.now()
+        query = Notification.query.filter(
+            Notification.status == "pending", Notification.next_attempt_at <= now
+        )
+        if shards > 1:
+            query = query.filter(Notification.id % shards == shard)
+        rows = query.order_by(Notification.id).limit(self.batch_size).all()
+        if not rows:
+            return {"sent": 0, "failed": 0}
+        notifications = [
+            {
+                "id": row.id,
+                "recipient": row.recipient,
+                "subject": row.subject,
+                "body": row.body,
+            }
+            for row in rows
+        ]
+        chunks = [
+            notifications[i :: self.concurrency]
+            for i in range(min(self.concurrency, len(notifications)))
+        ]
+        results = {}
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            for chunk_results in executor.map(self.send_chunk, chunks):
+                results.update(chunk_results)
+
+        stats = {"sent": 0, "failed": 0}
+        for row in rows:
+            error = results.get(row.id, "not sent")
+            if error is None:
+                row.status = "sent"
+                row.sent_date = datetime.now()
+                stats["sent"] += 1
+                continue
+            row.attempts += 1
+            row.last_error = error
+            stats["failed"] += 1
+            if row.attempts >= self.max_attempts:
+                row.status = "failed"
+            else:
+                delay = self.backoff * 2 ** (row.attempts - 1)
+                row.next_attempt_at = now + timedelta(
+                    seconds=random.uniform(delay / 2, delay)
+                )
+        db.session.commit()
+        metrics.emails.inc(stats["sent"], result="sent")
+        metrics.emails.inc(stats["failed"], result="failed")
+        return stats
+
+
+sender = OutboxSender(
+    server=app.config["MAIL_SERVER"],
+    port=app.config["MAIL_PORT"],
+    use_ssl=app.config["MAIL_USE_SSL"],
+    use_tls=app.config["MAIL_USE_TLS"],
+    username=app.config["MAIL_USERNAME"],
+    password=app.config["MAIL_PASSWORD"],
+    sender=app.config["MAIL_SENDER"],
+    batch_size=app.config["OUTBOX_BATCH_SIZE"],
+    concurrency=app.config["OUTBOX_CONCURRENCY"],
+    max_attempts=app.config["OUTBOX_MAX_ATTEMPTS"],
+    backoff=app.config["OUTBOX_BACKOFF"],
+)
+
+
+@app_job
+def send_outbox(shard=0, shards=1):
+    return sender.send_pending(shard, shards)
@@ -0,0 +1,56 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app import app
+
+
+class PasswordHasher:
+    # PBKDF2 is deliberately slow and holds the GIL, so hashing and checking
+    # run in a small pool of processes; the request thread only waits.
+    # workers=0 hashes in the calling thread.
+    def __init__(self, method, workers):
+        self.method = method
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def pool(self):
+        with self.lock:
+            if self.executor is None:
+                # spawn: forking a threaded web worker is not safe
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self.executor
+
+    def run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        try:
+            return self.pool().submit(func, *args).result()
+        except BrokenProcessPool:
+            app.logger.warning("password hashing pool broke, starting a new one")
+            with self.lock:
+                self.executor = None
+            return func(*args)
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self.run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        # "pbkdf2:sha256:260000$salt$hash": the part before the salt
+        return password_hash.split("$", 1)[0] != self.method
+
+
+hasher = PasswordHasher(
+    method=app.config["PASSWORD_HASH_METHOD"],
+    workers=app.config["PASSWORD_HASH_WORKERS"],
+)
@@ -0,0 +1,210 @@
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import requests
+
+from app import app
+from app.matching import SlotSnapshot
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens):
+        with self.lock:
+            self.refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, deadline=None):
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                delay = (1 - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + delay > deadline:
+                return False
+            time.sleep(delay)
+
+
+class PollEngine:
+    def __init__(self, max_workers, rate, burst):
+        self.max_workers = max_workers
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+            return self.buckets[host]
+
+    def run(self, calls, url, deadline):
+        # calls maps a key to (func, kwargs). Returns the results of the calls
+        # that finished before the deadline; failed and cancelled calls are
+        # left out and counted in the returned stats.
+        bucket = self.bucket(url)
+        results = {}
+        stats = {"calls": 0, "failed": 0, "cancelled": 0}
+        if not calls:
+            return results, stats
+        if time.monotonic() >= deadline:
+            stats["cancelled"] = len(calls)
+            return results, stats
+
+        def call(func, kwargs):
+            if time.monotonic() >= deadline or not bucket.acquire(deadline):
+                raise DeadlineExceeded
+            return func(**kwargs)
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        pending = {
+            executor.submit(call, func, kwargs): key
+            for key, (func, kwargs) in calls.items()
+        }
+        try:
+            while pending:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = pending.pop(future)
+                    try:
+                        results[key] = future.result()
+                        stats["calls"] += 1
+                    except DeadlineExceeded:
+                        stats["cancelled"] += 1
+                    except (ValueError, requests.RequestException) as error:
+                        stats["calls"] += 1
+                        stats["failed"] += 1
+                        app.logger.warning("poll %s failed: %s", key, error)
+                    except Exception:
+                        # a malformed payload fails its own call, not the tick
+                        stats["calls"] += 1
+                        stats["failed"] += 1
+                        app.logger.exception("poll %s failed", key)
+        finally:
+            stats["cancelled"] += len(pending)
+            executor.shutdown(wait=False, cancel_futures=True)
+        return results, stats
+
+
+class ResourceState:
+    def __init__(self, key, nearest_start):
+        self.key = key
+        self.nearest_start = nearest_start
+        self.next_poll = None
+        self.backoff = 1
+        self.snapshot = SlotSnapshot()
+
+
+class PollQueue:
+    # Every watched resource gets its own next poll time, kept in a heap.
+    # Resources whose nearest window is close, or whose slots just changed,
+    # are polled every min_interval; the interval grows with the lead time
+    # and doubles on each poll that changed nothing, up to max_interval.
+    # A per-minute budget caps how many resources a tick may poll.
+    LEAD_FACTORS = ((1, 1), (3, 2), (7, 5))
+    FAR_FACTOR = 15
+
+    def __init__(self, min_interval, max_interval, budget):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget = TokenBucket(budget / 60, budget)
+        self.states = {}
+        self.heap = []
+
+    def push(self, state, next_poll):
+        state.next_poll = next_poll
+        heapq.heappush(self.heap, (next_poll, state.key))
+
+    def sync(self, resources, now):
+        # resources maps (speciality_id, available_resource_id) to the start
+        # of its earliest active window; resources missing from it retire.
+        for key, nearest_start in resources.items():
+            state = self.states.get(key)
+            if state is None:
+                state = self.states[key] = ResourceState(key, nearest_start)
+                self.push(state, now)
+            state.nearest_start = nearest_start
+        for key in set(self.states) - set(resources):
+            del self.states[key]
+
+    def due(self, now, cost):
+        keys = []
+        while self.heap and self.heap[0][0] <= now:
+            next_poll, key = self.heap[0]
+            state = self.states.get(key)
+            if state is None or state.next_poll != next_poll:
+                heapq.heappop(self.heap)
+                continue
+            if not self.budget.try_acquire(cost):
+                break
+            heapq.heappop(self.heap)
+            keys.append(key)
+        return keys
+
+    def interval(self, state):
+        lead = (state.nearest_start - datetime.now()).total_seconds() / 86400
+        factor = self.FAR_FACTOR
+        for days, lead_factor in self.LEAD_FACTORS:
+            if lead < days:
+                factor = lead_factor
+                break
+        return min(self.max_interval, self.min_interval * factor * state.backoff)
+
+    def snapshot(self, key):
+        state = self.states.get(key)
+        return state.snapshot if state is not None else SlotSnapshot()
+
+    def reschedule(self, key, now, changed):
+        # changed is None when the resource could not be polled this time.
+        state = self.states.get(key)
+        if state is None:
+            return
+        if changed:
+            state.backoff = 1
+        elif changed is not None:
+            state.backoff = min(
+                state.backoff * 2, self.max_interval / self.min_interval
+            )
+        self.push(state, now + self.interval(state))
+
+
+engine = PollEngine(
+    max_workers=app.config["WATCHER_CONCURRENCY"],
+    rate=app.config["EMIAS_RATE_LIMIT"],
+    burst=app.config["EMIAS_RATE_BURST"],
+)
+
+queue = PollQueue(
+    min_interval=app.config["WATCHER_MIN_INTERVAL"],
+    max_interval=app.config["WATCHER_MAX_INTERVAL"],
+    budget=app.config["WATCHER_BUDGET"],
+)
@@ -0,0 +1,63 @@
+from datetime import datetime
+
+from sqlalchemy import or_
+
+from app import app, db
+from app.jobs import app_job
+from app.models import Appointment, ArchivedAppointment
+from app.watcher import shard_filter
+
+
+def archivable(now, shard=0, shards=1):
+    # Matched or retired by the watcher, or past their window already (in
+    # case no watcher shard has retired them yet).
+    query = Appointment.query.filter(
+        or_(Appointment.status == False, Appointment.end_time < now)
+    )
+    return shard_filter(query, shard, shards)
+
+
+def archived_row(row, now):
+    # the archive numbers its rows itself
+    values = row._asdict()
+    values["appointment_id"] = values.pop("id")
+    return {**values, "status": False, "archived_date": now}
+
+
+@app_job
+def archive_appointments(shard=0, shards=1):
+    # Moves the rows into appointment_archive one batch per transaction,
+    # walking the primary key, so that neither the watcher nor the web
+    # threads wait behind one long delete.
+    now = datetime.now()
+    batch_size = app.config["ARCHIVE_BATCH_SIZE"]
+    archived = 0
+    batches = 0
+    last_id = 0
+    while True:
+        rows = (
+            archivable(now, shard, shards)
+            .filter(Appointment.id > last_id)
+            .order_by(Appointment.id)
+            .limit(batch_size)
+            .with_entities(*Appointment.__table__.columns)
+            .all()
+        )
+        if not rows:
+            break
+        db.session.execute(
+            ArchivedAppointment.__table__.insert(),
+            [archived_row(row, now) for row in rows],
+        )
+        last_id = rows[-1].id
+        Appointment.query.filter(Appointment.id.in_([row.id for row in rows])).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        archived += len(rows)
+        batches += 1
+        if len(rows) < batch_size:
+            break
+    if archived:
+        app.logger.info("archived %d appointments in %d batches", archived, batches)
+    return {"archived": archived, "batches": batches}
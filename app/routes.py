@@ -1,33 +1,84 @@
-import atexit
-from datetime import datetime, time
+import json
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, time, timezone
+from hashlib import blake2b
 from pydoc import doc
-from cachetools import cached, TTLCache
-from email.message import EmailMessage
 from functools import wraps
-import smtplib, ssl
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from flask import jsonify, render_template, flash, redirect, url_for, request
+from flask import (
+    Response,
+    abort,
+    g,
+    jsonify,
+    render_template,
+    flash,
+    redirect,
+    url_for,
+    request,
+    stream_with_context,
+)
 from flask_login import current_user, login_user, logout_user, login_required
-import requests
-
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
 from app import app
 from app import db
 from app import forms
+from app import metrics
 from app.forms import LoginForm, RegistrationForm, EditProfileForm, AppointmentForm
-from app.models import Appointment, User
-from config import EMAIL_ADDRESS, EMAIL_PASSWORD
+from app.cache import cache
+from app.emias import (
+    client,
+    get_doctors_info,
+    get_specialities_info,
+    invalidate_patient,
+)
+from app.models import Appointment, User, forget_user
+
+
+if app.config["METRICS_TRACE"]:
+    metrics.enable_traces()
+if app.config["METRICS_DIR"]:
+    metrics.use_directory(
+        app.config["METRICS_DIR"], app.config["METRICS_FLUSH_INTERVAL"]
+    )
+
 
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
 
-context = ssl.create_default_context()
 
+@app.after_request
+def finish_request_metrics(response):
+    metrics.finish_request(request, response)
+    return response
 
-def check_error(r):
-    if not r.ok:
-        raise ValueError('ЕМИАС временно недоступен')
-    if "error" in r.json():
-        message = r.json()["error"]["message"]
-        raise ValueError(message)
+
+@app.after_request
+def mark_stale_response(response):
+    if "emias_stale_since" in g:
+        response.headers["Warning"] = '110 - "Response is Stale"'
+    return response
+
+
+@app.context_processor
+def inject_stale_since():
+    # set by the EMIAS cache when it fell back to an expired entry
+    if "emias_stale_since" not in g:
+        return {}
+    stale_since = datetime.fromtimestamp(g.emias_stale_since)
+    return {"emias_stale_since": stale_since.strftime("%d.%m.%Y %H:%M")}
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    if not metrics.authorized(
+        request.headers.get("Authorization"), app.config["METRICS_TOKEN"]
+    ):
+        abort(401)
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
 
 
 def error_decorator(func):
@@ -48,20 +99,7 @@ def error_decorator(func):
 def get_specialities():
     if not current_user.oms_number or not current_user.birth_date:
         return {"error": "Не передан номер ОМС или дата рождения"}
-    r = requests.post(
-        "https://emias.info/api/new/eip5orch?getSpecialitiesInfo",
-        json={
-            "jsonrpc": "2.0",
-            "id": "",
-            "method": "getSpecialitiesInfo",
-            "params": {
-                "omsNumber": current_user.oms_number,
-                "birthDate": current_user.birth_date.strftime("%Y-%m-%d"),
-            },
-        },
-    )
-    check_error(r)
-    results = r.json()["result"]
+    results = get_specialities_info(current_user.oms_number, current_user.birth_date)
     specialities = [
         {"speciality_id": result["code"], "name": result["name"]} for result in results
     ]
@@ -74,21 +112,16 @@ def get_specialities():
 def get_doctors(speciality_id):
     if not current_user.oms_number or not current_user.birth_date:
         return {"error": "Не передан номер ОМС или дата рождения"}
-    r = requests.post(
-        "https://emias.info/api/new/eip5orch?getDoctorsInfo",
-        json={
-            "jsonrpc": "2.0",
-            "id": "",
-            "method": "getDoctorsInfo",
-            "params": {
-                "omsNumber": current_user.oms_number,
-                "birthDate": current_user.birth_date.strftime("%Y-%m-%d"),
-                "specialityId": str(speciality_id),
-            },
-        },
+    results = get_doctors_info(
+        current_user.oms_number, current_user.birth_date, speciality_id
     )
-    check_error(r)
-    results = r.json()["result"]
+    if app.config["DOCTORS_STREAMING"]:
+        return Response(
+            stream_with_context(
+                stream_template("doctors.html", doctors=iter_doctors(results))
+            )
+        )
+    prefetch_schedules(result["lpuId"] for result in results)
     doctors = [
         {
             "hospital_id": result["lpuId"],
@@ -101,6 +134,54 @@ def get_doctors(speciality_id):
     return render_template("doctors.html", doctors=doctors)
 
 
+def stream_template(template_name, **context):
+    app.update_template_context(context)
+    return app.jinja_env.get_template(template_name).generate(context)
+
+
+def prefetch_schedules(hospital_ids):
+    # Warms the schedule_request cache for every distinct hospital at once,
+    # so the per-doctor filtering below only reads cached results.
+    hospital_ids = list(dict.fromkeys(hospital_ids))
+    if not hospital_ids:
+        return
+    workers = min(app.config["SCHEDULE_PREFETCH_WORKERS"], len(hospital_ids))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(schedule_request, hospital_ids))
+
+
+def iter_doctors(results):
+    # Yields doctors hospital by hospital, as soon as each schedule arrives.
+    by_hospital = defaultdict(list)
+    for result in results:
+        by_hospital[result["lpuId"]].append(result)
+    if not by_hospital:
+        return
+    workers = min(app.config["SCHEDULE_PREFETCH_WORKERS"], len(by_hospital))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {
+        executor.submit(schedule_request, hospital_id): hospital_id
+        for hospital_id in by_hospital
+    }
+    try:
+        for future in as_completed(futures):
+            hospital_id = futures[future]
+            try:
+                future.result()
+            except ValueError as error:
+                app.logger.warning("schedule of %s failed: %s", hospital_id, error)
+                continue
+            for result in by_hospital[hospital_id]:
+                if get_schedule(hospital_id, result["id"])[0]:
+                    yield {
+                        "hospital_id": hospital_id,
+                        "available_resource_id": result["id"],
+                        "name": result["name"],
+                    }
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 @app.route(
     "/specialities/<int:speciality_id>/doctors/<int:hospital_id>/<int:available_resource_id>/schedule",
     methods=["GET", "POST"],
@@ -113,13 +194,20 @@ def schedule(speciality_id, hospital_id, available_resource_id):
     form.date.choices = [(row["date"], row["date"]) for row in current_schedule]
 
     if request.method == 'GET':
-        for row in current_schedule:
-            if row["date"] == form.date.choices[0][0]:
-                time_arrangement = create_time_arrangement(row["time_interval"])
-                form.start_time.choices = time_arrangement
-                form.end_time.choices = time_arrangement
+        # a doctor without reception dates gets an empty form
+        time_arrangement = (
+            current_schedule[0]["time_arrangement"] if current_schedule else []
+        )
+        form.start_time.choices = time_arrangement
+        form.end_time.choices = time_arrangement
 
-        return render_template("schedule.html", form=form)
+        # every date's hours go into the page, so switching dates is local
+        time_arrangements = {
+            row["date"]: row["time_arrangement"] for row in current_schedule
+        }
+        return render_template(
+            "schedule.html", form=form, time_arrangements=time_arrangements
+        )
     else:
         form.start_time.choices = [(form.start_time.data, form.start_time.data), (form.end_time.data, form.end_time.data)]
         form.end_time.choices = [(form.start_time.data, form.start_time.data), (form.end_time.data, form.end_time.data)]
@@ -136,35 +224,71 @@ def schedule(speciality_id, hospital_id, available_resource_id):
             return redirect(url_for("get_specialities"))
 
 
-@cached(cache=TTLCache(ttl=3600, maxsize=100))
+@cache.cached("get_lpu_schedule_info")
 def schedule_request(hospital_id):
-    r = requests.post(
-        "https://emias.info/api/new/eip",
-        json={
-            "jsonrpc": "2.0",
-            "id": 1,
-            "method": "get_lpu_schedule_info",
-            "params": {"lpu_id": hospital_id},
-        },
+    return build_schedule(
+        client.call("get_lpu_schedule_info", {"lpu_id": hospital_id})[
+            "availableResource"
+        ]
     )
-    check_error(r)
-    return r.json()["result"]["availableResource"]
 
 
-def get_schedule(hospital_id, available_resource_id):
-    results = schedule_request(hospital_id)
-    schedule = []
-    doctor = None
+def build_schedule(results):
+    # version changes only when the hospital's schedule does; it is the ETag
+    # of current_available_time.
+    return {
+        "version": blake2b(
+            json.dumps(results, sort_keys=True).encode(), digest_size=12
+        ).hexdigest(),
+        "fetched_at": datetime.now(timezone.utc).timestamp(),
+        "resources": index_schedule(results),
+    }
+
+
+def index_schedule(results):
+    # Built once per fetch and cached, so every lookup below is a dict read.
+    index = {}
     for result in results:
-        if str(available_resource_id) == result["id"]:
-            doctor = result["name"]
-            for row in result["schedule"]:
-                if "receptionInfo" in row and "-" in row["receptionInfo"]:
-                    schedule.append(
-                        {"date": row["date"], "time_interval": row["receptionInfo"]}
-                    )
+        resource = index.setdefault(
+            str(result["id"]), {"name": None, "schedule": [], "time_arrangements": {}}
+        )
+        resource["name"] = result["name"]
+        for row in result["schedule"]:
+            reception_info = row.get("receptionInfo")
+            if not isinstance(reception_info, str) or "-" not in reception_info:
+                continue
+            try:
+                time_arrangement = create_time_arrangement(reception_info)
+                date = row["date"]
+            except (KeyError, ValueError):
+                # one bad row must not take down the whole hospital
+                app.logger.warning(
+                    "skipping schedule row %r of resource %s", row, result["id"]
+                )
+                continue
+            time_intervals = reception_info.split("-")
+            resource["schedule"].append(
+                {
+                    "date": date,
+                    "time_interval": reception_info,
+                    "start": time_intervals[0],
+                    "end": time_intervals[-1],
+                    "time_arrangement": time_arrangement,
+                }
+            )
+            resource["time_arrangements"][date] = time_arrangement
+    return index
 
-    return doctor, schedule
+
+def get_resource(hospital_id, available_resource_id):
+    return schedule_request(hospital_id)["resources"].get(str(available_resource_id))
+
+
+def get_schedule(hospital_id, available_resource_id):
+    resource = get_resource(hospital_id, available_resource_id)
+    if resource is None:
+        return None, []
+    return resource["name"], resource["schedule"]
 
 
 @app.route(
@@ -174,12 +298,21 @@ def get_schedule(hospital_id, available_resource_id):
 @login_required
 def current_available_time(speciality_id, hospital_id, available_resource_id):
     date = request.args.get("date")
-    schedule = get_schedule(hospital_id, available_resource_id)[1]
-    for row in schedule:
-        if row["date"] == date:
-            return jsonify(create_time_arrangement(row["time_interval"]))
-
-    return jsonify([])
+    hospital_schedule = schedule_request(hospital_id)
+    resource = hospital_schedule["resources"].get(str(available_resource_id))
+    if resource is None:
+        response = jsonify([])
+    else:
+        response = jsonify(resource["time_arrangements"].get(date, []))
+    # Revalidated on every use: a repeated request for an unchanged hospital
+    # schedule is answered with 304 Not Modified.
+    response.set_etag(hospital_schedule["version"])
+    response.last_modified = datetime.fromtimestamp(
+        hospital_schedule["fetched_at"], timezone.utc
+    )
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 def create_time_arrangement(time_intervals):
@@ -193,6 +326,10 @@ def create_time_arrangement(time_intervals):
 def create_appointment(
     available_resource_id, speciality_id, doctor, start_time, end_time
 ):
+    window = (available_resource_id, start_time, end_time)
+    if active_windows(current_user.id, [window]):
+        flash("Такая заявка уже есть.")
+        return
     appointment = Appointment(
         available_resource_id=available_resource_id,
         speciality_id=speciality_id,
@@ -202,96 +339,19 @@ def create_appointment(
         user_id=current_user.id,
     )
     db.session.add(appointment)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        # only ix_appointment_active_window is a duplicate: a concurrent
+        # request created the same watch since the check above
+        if not active_windows(current_user.id, [window]):
+            raise
+        flash("Такая заявка уже есть.")
+        return
     flash("Ваша заявка принята! Ждите уведомления на почту.")
 
 
-def scheduler():
-    appointments = Appointment.query.filter(Appointment.status == True).all()
-    for appointment in appointments:
-        r = requests.post(
-            "https://emias.info/api/new/eip5orch?getDoctorsInfo",
-            json={
-                "jsonrpc": "2.0",
-                "id": "",
-                "method": "getDoctorsInfo",
-                "params": {
-                    "omsNumber": appointment.user.oms_number,
-                    "birthDate": appointment.user.birth_date.strftime("%Y-%m-%d"),
-                    "specialityId": appointment.speciality_id,
-                },
-            },
-        )
-        if not r.ok or ("error" in r.json()):
-            continue
-        results = r.json()["result"]
-        for result in results:
-            if result["id"] == appointment.available_resource_id:
-                if result["complexResource"]:
-                    complex_resource_id = result["complexResource"][0]["id"]
-                    schedule = get_available_schedule(
-                        oms_number=appointment.user.oms_number,
-                        birth_date=appointment.user.birth_date,
-                        available_resource_id=appointment.available_resource_id,
-                        complex_resource_id=complex_resource_id,
-                    )
-                    for time_slot in schedule:
-                        if (
-                            appointment.start_time <= time_slot <= appointment.end_time
-                        ) and appointment.status:
-                            appointment.status = False
-                            text = f"Появилась доступная запись. Проверьте на сайте ЕМИАС.\nЗапись: {appointment.doctor}\t{time_slot}"
-                            msg = EmailMessage()
-                            msg["Subject"] = "Новая запись"
-                            msg["From"] = "kharitonova.si16@physics.msu.ru"
-                            msg["To"] = appointment.user.email
-                            msg.set_content(text)
-                            with smtplib.SMTP_SSL(
-                                "smtp.gmail.com", 465, context=context
-                            ) as server:
-                                server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-                                server.send_message(msg)
-                                server.quit()
-                            db.session.commit()
-
-
-@error_decorator
-def get_available_schedule(
-    oms_number, birth_date, available_resource_id, complex_resource_id
-):
-    r = requests.post(
-        "https://emias.info/api/new/eip5orch?getAvailableResourceScheduleInfo",
-        json={
-            "jsonrpc": "2.0",
-            "id": "",
-            "method": "getAvailableResourceScheduleInfo",
-            "params": {
-                "omsNumber": oms_number,
-                "birthDate": str(birth_date),
-                "availableResourceId": str(available_resource_id),
-                "complexResourceId": str(complex_resource_id),
-            },
-        },
-    )
-    check_error(r)
-    results = r.json()["result"]["scheduleOfDay"]
-    schedule = []
-    for result in results:
-        for slot in result["scheduleBySlot"][0]["slot"]:
-            start_available_time = datetime.strptime(
-                slot["startTime"], "%Y-%m-%dT%H:%M:%S%z"
-            ).replace(tzinfo=None)
-            schedule.append(start_available_time)
-    return schedule
-
-
-sched = BackgroundScheduler()
-sched.add_job(func=scheduler, trigger="interval", minutes=2)
-sched.start()
-# Shut down the scheduler when exiting the app
-atexit.register(lambda: sched.shutdown())
-
-
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if current_user.is_authenticated:
@@ -302,11 +362,28 @@ def login():
         if user is None or not user.check_password(form.password.data):
             flash("Неверный email или пароль")
             return redirect(url_for("login"))
+        if user.password_needs_rehash():
+            user.set_password(form.password.data)
+            db.session.commit()
         login_user(user, remember=form.remember_me.data)
+        if user.oms_number and user.birth_date:
+            warm_patient_cache(user.oms_number, user.birth_date)
         return redirect(url_for("get_specialities"))
     return render_template("login.html", title="Войти", form=form)
 
 
+def warm_patient_cache(oms_number, birth_date):
+    # The login redirects to the specialities page; its EMIAS call starts
+    # now, and the page joins it instead of sending another one.
+    def run():
+        try:
+            get_specialities_info(oms_number, birth_date)
+        except ValueError as error:
+            app.logger.warning("warming specialities failed: %s", error)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
 @app.route("/logout")
 def logout():
     logout_user()
@@ -332,13 +409,251 @@ def register():
     return render_template("register.html", title="Регистрация", form=form)
 
 
+def user_appointments(user_id):
+    return Appointment.query.filter(
+        Appointment.status == True, Appointment.user_id == user_id
+    ).order_by(Appointment.start_time, Appointment.id)
+
+
+def parse_cursor(cursor):
+    # "<start_time>_<id>" of the last appointment on the previous page
+    try:
+        start_time, id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(start_time), int(id)
+    except ValueError:
+        abort(400)
+
+
+def appointments_page_query(user_id, cursor=None):
+    # Keyset pagination: a page continues after the (start_time, id) of the
+    # previous one through ix_appointment_active_user, however deep it is.
+    # One row more than a page tells whether there is a next one.
+    query = user_appointments(user_id)
+    if cursor:
+        query = query.filter(
+            tuple_(Appointment.start_time, Appointment.id) > parse_cursor(cursor)
+        )
+    return query.limit(app.config["APPOINTMENTS_PAGE_SIZE"] + 1)
+
+
+def appointments_page(user_id, cursor=None):
+    size = app.config["APPOINTMENTS_PAGE_SIZE"]
+    appointments = appointments_page_query(user_id, cursor).all()
+    if len(appointments) <= size:
+        return appointments, None
+    last = appointments[size - 1]
+    return appointments[:size], f"{last.start_time.isoformat()}_{last.id}"
+
+
 @app.route("/user")
 @login_required
 def user():
-    appointments = Appointment.query.filter(
-        Appointment.status == True, Appointment.user_id == current_user.id
-    ).all()
-    return render_template("user.html", user=current_user, appointments=appointments)
+    appointments, next_cursor = appointments_page(
+        current_user.id, request.args.get("after")
+    )
+    return render_template(
+        "user.html",
+        user=current_user,
+        appointments=appointments,
+        next_cursor=next_cursor,
+    )
+
+
+@app.route("/api/appointments", methods=["GET"])
+@login_required
+def api_appointments():
+    appointments, next_cursor = appointments_page(
+        current_user.id, request.args.get("after")
+    )
+    return jsonify(
+        {
+            "appointments": [
+                {
+                    "id": appointment.id,
+                    "speciality_id": appointment.speciality_id,
+                    "available_resource_id": appointment.available_resource_id,
+                    "doctor": appointment.doctor,
+                    "start_time": appointment.start_time.isoformat(),
+                    "end_time": appointment.end_time.isoformat(),
+                }
+                for appointment in appointments
+            ],
+            "next": next_cursor,
+        }
+    )
+
+
+def parse_window(item):
+    try:
+        date = str(item["date"])
+        window = {
+            "speciality_id": int(item["speciality_id"]),
+            "hospital_id": int(item["hospital_id"]),
+            "available_resource_id": int(item["available_resource_id"]),
+            "date": date,
+            "start": str(item["start_time"]),
+            "end": str(item["end_time"]),
+        }
+        window["start_time"] = datetime.strptime(
+            f"{date} {window['start']}", "%Y-%m-%d %H:%M"
+        )
+        window["end_time"] = datetime.strptime(
+            f"{date} {window['end']}", "%Y-%m-%d %H:%M"
+        )
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Неверный формат записи")
+    if window["start_time"] > window["end_time"]:
+        raise ValueError("Время начала позже времени окончания")
+    if window["end_time"] <= datetime.now():
+        raise ValueError("Время записи уже прошло")
+    return window
+
+
+def fetch_schedules(hospital_ids):
+    # One schedule per distinct hospital, fetched in parallel; a hospital
+    # EMIAS failed for maps to its error, so that only its own entries are
+    # rejected.
+    hospital_ids = list(dict.fromkeys(hospital_ids))
+    if not hospital_ids:
+        return {}
+    workers = min(app.config["SCHEDULE_PREFETCH_WORKERS"], len(hospital_ids))
+    schedules = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(schedule_request, hospital_id): hospital_id
+            for hospital_id in hospital_ids
+        }
+        for future in as_completed(futures):
+            try:
+                schedules[futures[future]] = future.result()
+            except ValueError as error:
+                schedules[futures[future]] = error
+    return schedules
+
+
+def check_window(window, schedule):
+    if isinstance(schedule, ValueError):
+        raise schedule
+    resource = schedule["resources"].get(str(window["available_resource_id"]))
+    if resource is None:
+        raise ValueError("Врач не найден в расписании больницы")
+    hours = resource["time_arrangements"].get(window["date"])
+    if hours is None:
+        raise ValueError("Врач не принимает в этот день")
+    if window["start"] not in hours or window["end"] not in hours:
+        raise ValueError("Время вне расписания врача")
+    return resource["name"]
+
+
+def active_windows(user_id, keys):
+    return {
+        (row.available_resource_id, row.start_time, row.end_time): row.id
+        for row in db.session.query(
+            Appointment.id,
+            Appointment.available_resource_id,
+            Appointment.start_time,
+            Appointment.end_time,
+        ).filter(
+            Appointment.status == True,
+            Appointment.user_id == user_id,
+            tuple_(
+                Appointment.available_resource_id,
+                Appointment.start_time,
+                Appointment.end_time,
+            ).in_(keys),
+        )
+    }
+
+
+@app.route("/api/appointments", methods=["POST"])
+@login_required
+def create_appointments_bulk():
+    # Many watches in one request: every hospital schedule is read once,
+    # duplicates are found with one query and the new rows go in with one
+    # INSERT. The response has a result per entry, in order.
+    payload = request.get_json(silent=True)
+    items = payload.get("appointments") if isinstance(payload, dict) else None
+    if not isinstance(items, list):
+        return jsonify({"error": "Ожидается список appointments"}), 400
+    if len(items) > app.config["APPOINTMENTS_BULK_LIMIT"]:
+        return (
+            jsonify(
+                {
+                    "error": "Не больше "
+                    f"{app.config['APPOINTMENTS_BULK_LIMIT']} записей за раз"
+                }
+            ),
+            400,
+        )
+
+    results = [None] * len(items)
+    windows = {}
+    for i, item in enumerate(items):
+        try:
+            windows[i] = parse_window(item)
+        except ValueError as error:
+            results[i] = {"status": "rejected", "error": str(error)}
+    schedules = fetch_schedules(window["hospital_id"] for window in windows.values())
+    for i, window in list(windows.items()):
+        try:
+            window["doctor"] = check_window(window, schedules[window["hospital_id"]])
+        except ValueError as error:
+            results[i] = {"status": "rejected", "error": str(error)}
+            del windows[i]
+
+    def key(window):
+        return (
+            window["available_resource_id"],
+            window["start_time"],
+            window["end_time"],
+        )
+
+    existing = active_windows(current_user.id, list({key(w) for w in windows.values()}))
+    rows = {}
+    for i, window in windows.items():
+        if key(window) in existing or key(window) in rows:
+            results[i] = {"status": "rejected", "error": "Такая запись уже есть"}
+            continue
+        rows[key(window)] = {
+            "available_resource_id": window["available_resource_id"],
+            "speciality_id": window["speciality_id"],
+            "doctor": window["doctor"],
+            "start_time": window["start_time"],
+            "end_time": window["end_time"],
+            "user_id": current_user.id,
+        }
+    while rows:
+        try:
+            db.session.execute(
+                Appointment.__table__.insert().values(list(rows.values()))
+            )
+            db.session.commit()
+            break
+        except IntegrityError:
+            # a concurrent request created some of the same watches first
+            db.session.rollback()
+            existing = active_windows(current_user.id, list(rows))
+            if not existing:
+                raise
+            for i, window in windows.items():
+                if key(window) in existing and key(window) in rows:
+                    results[i] = {
+                        "status": "rejected",
+                        "error": "Такая запись уже есть",
+                    }
+                    del rows[key(window)]
+    if rows:
+        created = active_windows(current_user.id, list(rows))
+        for i, window in windows.items():
+            if results[i] is None:
+                results[i] = {"status": "created", "id": created.get(key(window))}
+    return jsonify(
+        {
+            "created": sum(result["status"] == "created" for result in results),
+            "rejected": sum(result["status"] == "rejected" for result in results),
+            "results": results,
+        }
+    )
 
 
 @app.route("/edit_profile", methods=["GET", "POST"])
@@ -346,11 +661,17 @@ def user():
 def edit_profile():
     form = EditProfileForm()
     if form.validate_on_submit():
+        if (current_user.oms_number, current_user.birth_date) != (
+            form.oms_number.data,
+            form.birth_date.data,
+        ):
+            invalidate_patient(current_user.oms_number, current_user.birth_date)
         current_user.oms_number = form.oms_number.data
         current_user.birth_date = form.birth_date.data
         current_user.email = form.email.data
         current_user.set_password(form.password.data)
         db.session.commit()
+        forget_user(current_user.id)
         flash("Изменения успешно сохранены.")
         return redirect(url_for("edit_profile"))
     elif request.method == "GET":
@@ -366,8 +687,10 @@ def edit_profile():
 @app.route("/delete/<appointment_id>", methods=["GET"])
 @login_required
 def delete_appointment(appointment_id):
-    a = Appointment.query.filter(Appointment.id == appointment_id).first()
+    # the row may have been archived since the page was rendered
+    a = Appointment.query.filter(Appointment.id == appointment_id).first_or_404()
     db.session.delete(a)
     db.session.commit()
     flash("Запись успешно удалена.")
     return redirect(url_for("user"))
+
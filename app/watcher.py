@@ -0,0 +1,401 @@
+from datetime import datetime
+from itertools import chain, groupby
+from time import monotonic
+
+from sqlalchemy import case, func, tuple_
+
+from app import app, db, metrics
+from app.emias import breakers, client, get_doctors_info
+from app.jobs import app_job
+from app.matching import match_slots
+from app.models import Appointment, User
+from app.outbox import enqueue_notifications
+from app.poller import engine, queue
+
+
+def shard_filter(query, shard, shards):
+    if shards > 1:
+        # every watch of a resource belongs to exactly one worker
+        query = query.filter(Appointment.available_resource_id % shards == shard)
+    return query
+
+
+def active_resources(shard=0, shards=1):
+    query = db.session.query(
+        Appointment.speciality_id,
+        Appointment.available_resource_id,
+        func.min(Appointment.start_time),
+    ).filter(Appointment.status == True, Appointment.end_time > datetime.now())
+    query = shard_filter(query, shard, shards).group_by(
+        Appointment.speciality_id, Appointment.available_resource_id
+    )
+    return {
+        (speciality_id, available_resource_id): nearest_start
+        for speciality_id, available_resource_id, nearest_start in query
+    }
+
+
+def retire_expired(shard=0, shards=1):
+    # Windows that have already ended can never match again.
+    query = Appointment.query.filter(
+        Appointment.status == True, Appointment.end_time < datetime.now()
+    )
+    retired = shard_filter(query, shard, shards).update(
+        {Appointment.status: False}, synchronize_session=False
+    )
+    db.session.commit()
+    return retired
+
+
+def active_watches(shard=0, shards=1, resources=None):
+    # Only the columns the watcher reads, joined with the patient in one
+    # query and streamed in chunks, ordered so that watches on one resource
+    # arrive together. resources limits it to some (speciality, resource)
+    # pairs.
+    query = (
+        db.session.query(
+            Appointment.id,
+            Appointment.available_resource_id,
+            Appointment.speciality_id,
+            Appointment.doctor,
+            Appointment.start_time,
+            Appointment.end_time,
+            Appointment.created_date,
+            User.id.label("user_id"),
+            User.oms_number,
+            User.birth_date,
+            User.email,
+        )
+        .join(User, Appointment.user_id == User.id)
+        # a window that has ended can never match
+        .filter(Appointment.status == True, Appointment.end_time > datetime.now())
+    )
+    if resources is not None:
+        query = query.filter(
+            tuple_(Appointment.speciality_id, Appointment.available_resource_id).in_(
+                resources
+            )
+        )
+    return (
+        shard_filter(query, shard, shards)
+        .order_by(Appointment.speciality_id, Appointment.available_resource_id)
+        .yield_per(app.config["WATCHER_CHUNK_SIZE"])
+    )
+
+
+def plan_polls(watches, chunk_size):
+    # Watches on the same doctor share one schedule, so the tick polls every
+    # (speciality, resource) pair once instead of once per appointment.
+    # Plans are cut at group boundaries every chunk_size watches.
+    plan = {}
+    size = 0
+    for key, group in groupby(
+        watches, key=lambda watch: (watch.speciality_id, watch.available_resource_id)
+    ):
+        plan[key] = list(group)
+        size += len(plan[key])
+        if size >= chunk_size:
+            yield plan
+            plan, size = {}, 0
+    if plan:
+        yield plan
+
+
+def find_complex_resource(doctors, available_resource_id):
+    for result in doctors:
+        if result["id"] == available_resource_id and result["complexResource"]:
+            return result["complexResource"][0]["id"]
+    return None
+
+
+def resolve_resources(plan, doctors_info):
+    # Maps every (speciality, resource) of the plan that could be found in
+    # the fetched doctor lists to its (resource, complex resource) schedule.
+    resolved = {}
+    unresolved = {}
+    for (speciality_id, available_resource_id), waiting in plan.items():
+        for (speciality, _), doctors in doctors_info.items():
+            if speciality != speciality_id:
+                continue
+            complex_resource_id = find_complex_resource(doctors, available_resource_id)
+            if complex_resource_id is not None:
+                resolved[(speciality_id, available_resource_id)] = (
+                    available_resource_id,
+                    complex_resource_id,
+                )
+                break
+        else:
+            unresolved[(speciality_id, available_resource_id)] = waiting
+    return resolved, unresolved
+
+
+def doctors_info_calls(plan, doctors_info, per_speciality):
+    calls = {}
+    for (speciality_id, _), waiting in plan.items():
+        # the first patient of the group whose doctor list is not known yet
+        watch = next(
+            (
+                watch
+                for watch in waiting
+                if (speciality_id, watch.user_id) not in doctors_info
+            ),
+            None,
+        )
+        if watch is None:
+            continue
+        key = (speciality_id, watch.user_id)
+        if per_speciality and any(
+            s == speciality_id for s, _ in chain(calls, doctors_info)
+        ):
+            continue
+        calls[key] = (
+            get_doctors_info,
+            {
+                "oms_number": watch.oms_number,
+                "birth_date": watch.birth_date,
+                "speciality_id": speciality_id,
+            },
+        )
+    return calls
+
+
+def poll_doctors_info(calls, doctors_info, poll):
+    doctors_info.update(poll(calls))
+    # a failed call counts as an empty list for the rest of the tick, so
+    # the next round moves on to another patient
+    for key in calls:
+        doctors_info.setdefault(key, [])
+
+
+def poll_plan(plan, doctors_info, schedules, poll, seen_at):
+    # getDoctorsInfo depends on the patient: the first round asks once per
+    # speciality; every further round asks, for each resource still missing,
+    # the next patient of its group, until it is found or every patient
+    # waiting for it was asked. doctors_info and schedules are shared by all
+    # plans of the tick.
+    poll_doctors_info(doctors_info_calls(plan, doctors_info, True), doctors_info, poll)
+    while True:
+        _, unresolved = resolve_resources(plan, doctors_info)
+        calls = doctors_info_calls(unresolved, doctors_info, False)
+        if not calls:
+            break
+        poll_doctors_info(calls, doctors_info, poll)
+    resolved, _ = resolve_resources(plan, doctors_info)
+
+    calls = {}
+    for key, resource_key in resolved.items():
+        if resource_key in schedules or resource_key in calls:
+            continue
+        speciality_id, available_resource_id = key
+        # preferably a patient whose own doctor list has the resource
+        watch = next(
+            (
+                watch
+                for watch in plan[key]
+                if find_complex_resource(
+                    doctors_info.get((speciality_id, watch.user_id), []),
+                    available_resource_id,
+                )
+                is not None
+            ),
+            plan[key][0],
+        )
+        available_resource_id, complex_resource_id = resource_key
+        calls[resource_key] = (
+            fetch_slot_times,
+            {
+                "oms_number": watch.oms_number,
+                "birth_date": watch.birth_date,
+                "available_resource_id": available_resource_id,
+                "complex_resource_id": complex_resource_id,
+            },
+        )
+    schedules.update(poll(calls))
+
+    # Only slots that were not there at the previous poll can notify the
+    # watches that poll already saw; newer watches see every slot.
+    # The snapshot updates are returned, not applied: the caller applies
+    # them once the matches are committed.
+    served = 0
+    matches = []
+    updates = {}
+    for key, resource_key in resolved.items():
+        if resource_key not in schedules:
+            continue
+        update = updates[key] = queue.snapshot(key).diff(
+            schedules[resource_key], seen_at
+        )
+        waiting = plan[key]
+        served += len(waiting)
+        fresh = []
+        known = []
+        for watch in waiting:
+            if (
+                update.previous_seen_at is None
+                or watch.created_date is None
+                or watch.created_date >= update.previous_seen_at
+            ):
+                fresh.append(watch)
+            else:
+                known.append(watch)
+        matches.extend(match_slots(update.slots, fresh))
+        if update.new_slots:
+            matches.extend(match_slots(update.new_slots, known))
+    return served, matches, updates
+
+
+@app_job
+def scheduler(shard=0, shards=1):
+    started = monotonic()
+    deadline = started + app.config["WATCHER_DEADLINE"]
+    seen_at = datetime.now()
+    url = app.config["EMIAS_URL"]
+    stats = {"calls": 0, "failed": 0, "cancelled": 0}
+
+    def poll(calls):
+        results, call_stats = engine.run(calls, url, deadline)
+        for name, value in call_stats.items():
+            stats[name] += value
+        return results
+
+    retired = retire_expired(shard, shards)
+    if breakers.rejecting(["getAvailableResourceScheduleInfo"]):
+        # Nothing would get through; the due resources stay due and the
+        # first tick after the cooldown sends the probe.
+        app.logger.warning("scheduler tick skipped: EMIAS circuit is open")
+        metrics.watcher_tick_duration.observe(monotonic() - started)
+        return {
+            "upstream_calls": 0,
+            "upstream_failed": 0,
+            "upstream_cancelled": 0,
+            "appointments_served": 0,
+            "appointments_active": 0,
+            "appointments_matched": 0,
+            "appointments_retired": retired,
+            "resources_due": 0,
+            "resources_watched": len(queue.states),
+            "circuit_open": True,
+        }
+    queue.sync(active_resources(shard, shards), monotonic())
+    # a resource costs one schedule call, plus a getDoctorsInfo at most
+    due = queue.due(monotonic(), cost=2)
+
+    active = 0
+    served = 0
+    matches = []
+    updates = {}
+    doctors_info = {}
+    schedules = {}
+    # due() took the keys off the heap: every one of them goes back on it,
+    # as not polled (changed=None) if the tick fails half way. The slots of
+    # a failed tick are not marked as seen, so the next one matches them.
+    applied = False
+    try:
+        for i in range(0, len(due), 250):
+            watches = active_watches(shard, shards, due[i : i + 250])
+            for plan in plan_polls(watches, app.config["WATCHER_CHUNK_SIZE"]):
+                active += sum(len(waiting) for waiting in plan.values())
+                plan_served, plan_matches, plan_updates = poll_plan(
+                    plan, doctors_info, schedules, poll, seen_at
+                )
+                served += plan_served
+                matches.extend(plan_matches)
+                updates.update(plan_updates)
+        matches = apply_matches(matches)
+        for update in updates.values():
+            update.apply()
+        applied = True
+    finally:
+        now = monotonic()
+        for key in due:
+            update = updates.get(key) if applied else None
+            queue.reschedule(key, now, update.changed if update else None)
+    metrics.watcher_tick_duration.observe(now - started)
+    metrics.watcher_appointments.inc(served)
+    metrics.watcher_matches.inc(len(matches))
+
+    app.logger.info(
+        "scheduler tick: %d upstream calls (%d failed, %d cancelled) "
+        "for %d of %d due appointments (%d of %d resources due, %d retired)",
+        stats["calls"],
+        stats["failed"],
+        stats["cancelled"],
+        served,
+        active,
+        len(due),
+        len(queue.states),
+        retired,
+    )
+    return {
+        "upstream_calls": stats["calls"],
+        "upstream_failed": stats["failed"],
+        "upstream_cancelled": stats["cancelled"],
+        "appointments_served": served,
+        "appointments_active": active,
+        "appointments_matched": len(matches),
+        "appointments_retired": retired,
+        "resources_due": len(due),
+        "resources_watched": len(queue.states),
+        "circuit_open": False,
+    }
+
+
+def apply_matches(matches, chunk_size=400):
+    # One transaction per tick: a bulk UPDATE per chunk of ids (chunked to
+    # stay under SQLite's bound-parameter limit) plus the outbox rows.
+    # Returns the matches that were applied.
+    if not matches:
+        return []
+    matched_date = datetime.now()
+    flipped = set()
+    for i in range(0, len(matches), chunk_size):
+        chunk = {
+            appointment.id: time_slot
+            for appointment, time_slot in matches[i : i + chunk_size]
+        }
+        Appointment.query.filter(
+            Appointment.id.in_(list(chunk)), Appointment.status == True
+        ).update(
+            {
+                Appointment.status: False,
+                Appointment.matched_slot: case(chunk, value=Appointment.id),
+                Appointment.matched_date: matched_date,
+            },
+            synchronize_session=False,
+        )
+        # Rows deleted, archived or matched since they were read are skipped
+        # by the UPDATE and get no email. This transaction holds the write
+        # locks of the rows it flipped, so they are the ones carrying its
+        # matched_date.
+        flipped.update(
+            id
+            for id, in db.session.query(Appointment.id).filter(
+                Appointment.id.in_(list(chunk)),
+                Appointment.status == False,
+                Appointment.matched_date == matched_date,
+            )
+        )
+    applied = [match for match in matches if match[0].id in flipped]
+    enqueue_notifications(applied)
+    db.session.commit()
+    return applied
+
+
+def fetch_slot_times(
+    oms_number, birth_date, available_resource_id, complex_resource_id
+):
+    results = client.call(
+        "getAvailableResourceScheduleInfo",
+        {
+            "omsNumber": oms_number,
+            "birthDate": str(birth_date),
+            "availableResourceId": str(available_resource_id),
+            "complexResourceId": str(complex_resource_id),
+        },
+    )["scheduleOfDay"]
+    return [
+        slot["startTime"]
+        for result in results
+        for slot in result["scheduleBySlot"][0]["slot"]
+    ]
+
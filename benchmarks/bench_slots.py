@@ -0,0 +1,97 @@
+"""Slot parsing and matching micro-benchmark.
+
+Compares the original watcher pipeline (strptime with %z per slot, then a
+slots x watches loop) with app.matching (fixed-format parsing into sorted
+epoch-minute arrays, then bisect) on a 30-day, multi-resource payload.
+
+    python -m benchmarks.bench_slots [--resources 50] [--watches 20]
+"""
+
+import argparse
+import random
+import timeit
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from app.matching import SlotSnapshot, match_slots
+
+Watch = namedtuple("Watch", "id start_time end_time")
+
+
+def make_payload(resources, days=30, start=datetime(2030, 1, 1)):
+    # 08:00-16:00 in 15 minute slots, with a few slots taken at random
+    payload = {}
+    for resource in range(resources):
+        slots = []
+        for day in range(days):
+            moment = start + timedelta(days=day, hours=8)
+            for _ in range(32):
+                if random.random() < 0.8:
+                    slots.append(moment.strftime("%Y-%m-%dT%H:%M:%S+03:00"))
+                moment += timedelta(minutes=15)
+        payload[resource] = slots
+    return payload
+
+
+def make_watches(count, days=30, start=datetime(2030, 1, 1)):
+    watches = []
+    for i in range(count):
+        begin = start + timedelta(
+            days=random.randrange(days), hours=random.randrange(7, 18)
+        )
+        watches.append(Watch(i, begin, begin + timedelta(hours=1)))
+    return watches
+
+
+def baseline(payload, watches):
+    matched = 0
+    for slots in payload.values():
+        schedule = [
+            datetime.strptime(slot, "%Y-%m-%dT%H:%M:%S%z").replace(tzinfo=None)
+            for slot in slots
+        ]
+        for watch in watches:
+            for time_slot in schedule:
+                if watch.start_time <= time_slot <= watch.end_time:
+                    matched += 1
+                    break
+    return matched
+
+
+def compact(payload, watches):
+    matched = 0
+    for slots in payload.values():
+        snapshot = SlotSnapshot()
+        snapshot.update(slots, None)
+        matched += len(match_slots(snapshot.slots, watches))
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resources", type=int, default=50)
+    parser.add_argument("--watches", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(1)
+    payload = make_payload(args.resources)
+    watches = make_watches(args.watches)
+    slots = sum(len(value) for value in payload.values())
+    assert baseline(payload, watches) == compact(payload, watches)
+
+    print(f"{args.resources} resources, {slots} slots, {args.watches} watches each")
+    results = {}
+    for name, func in (("strptime + loop", baseline), ("minutes + bisect", compact)):
+        best = min(
+            timeit.repeat(lambda: func(payload, watches), number=1, repeat=args.repeat)
+        )
+        results[name] = best
+        print(f"{name:>18}: {best * 1000:8.1f} ms")
+    print(
+        f"{'speedup':>18}: {results['strptime + loop'] / results['minutes + bisect']:8.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""Concurrent watcher writes and web reads against one database.
+
+Writer processes repeat the watcher's write path, like `flask watcher run`
+shards: read a batch of active watches from their shard and apply them as
+matches (bulk UPDATE plus outbox rows, one transaction). Reader threads
+request /user for random patients through the Flask test client. Each run
+has three phases, writers alone, readers alone and both at once, and reports
+throughput, latency and lock wait: the time the first write statement of a
+transaction plus its COMMIT took, which is where a writer queues behind
+other transactions. Compare it with the writers-only phase to see the
+contention. Every phase starts with all watches active again; the run stops
+with an error if the writers match them all before --duration is up.
+
+    python -m benchmarks.database [--duration 10] [--readers 8] [--writers 2]
+    python -m benchmarks.database --database-url postgresql://localhost/bench
+    python -m benchmarks.database compare [--postgres-url postgresql://...]
+
+--plain runs SQLite the way it was configured before: rollback journal,
+default pragmas, a new connection per checkout. compare runs plain SQLite,
+tuned SQLite and, given --postgres-url, PostgreSQL in turn. The benchmark
+drops and recreates every table, so point --database-url at a scratch
+database.
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from benchmarks.fake_emias import FakeEmias
+from benchmarks.load import create_appointments, percentile, rss, start_rss
+
+
+class Samples:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reads = []
+        self.writes = []
+        self.lock_waits = []
+        self.rows = 0
+        self.errors = {}
+        self.exhausted = False
+
+    def add(self, name, value):
+        with self.lock:
+            getattr(self, name).append(value)
+
+    def error(self, error):
+        message = str(getattr(error, "orig", error)).splitlines()[0]
+        with self.lock:
+            self.errors[message] = self.errors.get(message, 0) + 1
+
+    def result(self):
+        return self.writes, self.lock_waits, self.rows, self.errors, self.exhausted
+
+    def merge(self, result):
+        writes, lock_waits, rows, errors, exhausted = result
+        self.writes.extend(writes)
+        self.lock_waits.extend(lock_waits)
+        self.rows += rows
+        self.exhausted = self.exhausted or exhausted
+        for message, count in errors.items():
+            self.errors[message] = self.errors.get(message, 0) + count
+
+
+def ms(values, q):
+    return f"{percentile(values, q) * 1000:8.1f}ms" if values else f"{'-':>10}"
+
+
+def report(name, samples, elapsed, baseline):
+    print(
+        f"{name:<14} reads {len(samples.reads) / elapsed:8.1f}/s "
+        f"p50={ms(samples.reads, 0.5)} p99={ms(samples.reads, 0.99)}  "
+        f"writes {len(samples.writes) / elapsed:7.1f}/s "
+        f"({samples.rows / elapsed:7.0f} rows/s) "
+        f"p50={ms(samples.writes, 0.5)} p99={ms(samples.writes, 0.99)}"
+    )
+    print(
+        f"{'':<14} lock wait p50={ms(samples.lock_waits, 0.5)} "
+        f"p99={ms(samples.lock_waits, 0.99)} "
+        f"total={sum(samples.lock_waits):.2f}s  reader {rss(baseline)}"
+    )
+    for message, count in sorted(samples.errors.items()):
+        print(f"{'':<14} {count} x {message}")
+
+
+def load_app(args):
+    # app reads its configuration at import, so this runs first
+    os.environ["DATABASE_URL"] = args.database_url
+    from app import app, db
+
+    if args.plain:
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        from app import set_sqlite_pragmas
+
+        event.remove(Engine, "connect", set_sqlite_pragmas)
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {}
+    return app, db
+
+
+def watch_lock_waits(engine, samples):
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    # Per thread, since every thread has its own session and connection:
+    # the first write statement of a transaction takes the write lock (or,
+    # on PostgreSQL, the row locks) and COMMIT may wait for readers.
+    local = threading.local()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        local.started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        first_write = getattr(local, "waiting", None) is None
+        if first_write and statement.lstrip().upper().startswith(
+            ("INSERT", "UPDATE", "DELETE")
+        ):
+            local.waiting = time.perf_counter() - local.started
+
+    @event.listens_for(Session, "before_commit")
+    def before_commit(session):
+        local.committing = time.perf_counter()
+
+    @event.listens_for(Session, "after_commit")
+    def after_commit(session):
+        if getattr(local, "waiting", None) is not None:
+            samples.add(
+                "lock_waits", local.waiting + time.perf_counter() - local.committing
+            )
+        local.waiting = None
+
+    @event.listens_for(Session, "after_rollback")
+    def after_rollback(session):
+        local.waiting = None
+
+
+def write(args, shard, ready, stop, results):
+    from sqlalchemy.exc import OperationalError
+
+    app, db = load_app(args)
+    from app.watcher import active_watches, apply_matches
+
+    samples = Samples()
+    with app.app_context():
+        watch_lock_waits(db.engine, samples)
+        ready.wait()
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                watches = active_watches(shard, args.writers).limit(args.batch).all()
+                if not watches:
+                    samples.exhausted = True
+                    break
+                slot = datetime.now()
+                apply_matches([(watch, slot) for watch in watches])
+            except OperationalError as error:
+                db.session.rollback()
+                samples.error(error)
+                continue
+            finally:
+                db.session.remove()
+            samples.add("writes", time.perf_counter() - started)
+            samples.rows += len(watches)
+    results.put(samples.result())
+
+
+def reset_watches(app, db):
+    # Every phase starts from the same data: the writers of the previous one
+    # matched part of the watches and queued their emails.
+    from app.models import Appointment, Notification
+
+    with app.app_context():
+        Appointment.query.update(
+            {"status": True, "matched_slot": None, "matched_date": None}
+        )
+        Notification.query.delete()
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+
+
+def run(args):
+    from sqlalchemy.exc import OperationalError
+
+    app, db = load_app(args)
+    from app.models import User
+
+    with app.app_context():
+        pool = db.engine.pool
+        print(
+            f"{db.engine.url.get_backend_name()}{' (plain)' if args.plain else ''}: "
+            f"{args.writers} writer processes x {args.batch} rows, "
+            f"{args.readers} reader threads, {type(pool).__name__}"
+            f"{f'({pool.size()})' if hasattr(pool, 'size') else ''}"
+        )
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        create_appointments(args.appointments, FakeEmias(days=args.days))
+        users = db.session.query(db.func.count(User.id)).scalar()
+        db.session.remove()
+        db.engine.dispose()
+
+    def read(seed, samples, stop):
+        rng = random.Random(seed)
+        client = app.test_client()
+        while not stop.is_set():
+            with client.session_transaction() as session:
+                session["_user_id"] = str(rng.randint(1, users))
+                session["_fresh"] = True
+            started = time.perf_counter()
+            try:
+                response = client.get("/user")
+                response.get_data()
+            except OperationalError as error:
+                samples.error(error)
+                continue
+            if response.status_code != 200:
+                samples.error(RuntimeError(f"/user: {response.status_code}"))
+                continue
+            samples.add("reads", time.perf_counter() - started)
+
+    # spawn: the writers must not inherit the parent's connections
+    context = multiprocessing.get_context("spawn")
+    for name, writers, readers in (
+        ("writers only", args.writers, 0),
+        ("readers only", 0, args.readers),
+        ("mixed", args.writers, args.readers),
+    ):
+        reset_watches(app, db)
+        samples = Samples()
+        baseline = start_rss()
+        ready = context.Barrier(writers + 1)
+        stop = context.Event()
+        results = context.Queue()
+        processes = [
+            context.Process(target=write, args=(args, shard, ready, stop, results))
+            for shard in range(writers)
+        ]
+        for process in processes:
+            process.start()
+        ready.wait()
+        threads = [
+            threading.Thread(target=read, args=(seed, samples, stop))
+            for seed in range(readers)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        for process in processes:
+            samples.merge(results.get())
+            process.join()
+        if samples.exhausted:
+            sys.exit(
+                f"{name}: the writers matched every active watch before "
+                f"{args.duration:g}s were up; raise --appointments"
+            )
+        report(name, samples, time.perf_counter() - started, baseline)
+
+
+def run_compare(args):
+    # Each backend needs its own process: the engine is configured at import.
+    base = [sys.executable, "-m", "benchmarks.database", "run"] + [
+        f"--{name}={getattr(args, name)}"
+        for name in ("duration", "readers", "writers", "batch", "appointments")
+    ]
+    runs = [base + ["--plain"], base]
+    if args.postgres_url:
+        runs.append(base + [f"--database-url={args.postgres_url}"])
+    for command in runs:
+        subprocess.run(command, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "scenario", nargs="?", default="run", choices=("run", "compare")
+    )
+    parser.add_argument("--database-url")
+    parser.add_argument("--postgres-url")
+    parser.add_argument("--plain", action="store_true")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--batch", type=int, default=20)
+    parser.add_argument("--appointments", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=14)
+    args = parser.parse_args()
+    if args.scenario == "compare":
+        run_compare(args)
+        return
+    if not args.database_url:
+        directory = tempfile.mkdtemp(prefix="project_doctor_bench_")
+        args.database_url = "sqlite:///" + os.path.join(directory, "bench.db")
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
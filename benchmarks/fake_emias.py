@@ -0,0 +1,234 @@
+"""A local stand-in for the emias.info JSON-RPC API.
+
+Serves getSpecialitiesInfo, getDoctorsInfo, get_lpu_schedule_info and
+getAvailableResourceScheduleInfo on the same paths as the real API, with
+configurable latency, error rate and payload size, and counts every call.
+
+    python -m benchmarks.fake_emias --port 8765 --latency 0.05
+
+then run the app with EMIAS_URL=http://127.0.0.1:8765. GET /calls returns
+the calls per method so far, GET /calls?reset=1 also starts them over.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeEmias:
+    def __init__(
+        self,
+        latency=0.02,
+        error_rate=0.0,
+        specialities=10,
+        doctors=20,
+        hospitals=5,
+        days=14,
+        slots_per_day=16,
+        churn=0.0,
+        seed=1,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.specialities = specialities
+        self.doctors = doctors
+        self.hospitals = hospitals
+        self.days = days
+        self.slots_per_day = slots_per_day
+        self.churn = churn
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def doctor_ids(self, speciality_id):
+        return [speciality_id * 1000 + i for i in range(self.doctors)]
+
+    def hospital_id(self, doctor_id):
+        return 100 + doctor_id % self.hospitals
+
+    def dates(self):
+        today = date.today()
+        return [today + timedelta(days=day + 1) for day in range(self.days)]
+
+    def specialities_info(self, params):
+        return [
+            {"code": code, "name": f"Специальность {code}"}
+            for code in range(1, self.specialities + 1)
+        ]
+
+    def doctors_info(self, params):
+        return [
+            {
+                "id": doctor_id,
+                "lpuId": self.hospital_id(doctor_id),
+                "name": f"Врач {doctor_id}",
+                "complexResource": [{"id": doctor_id * 10}],
+            }
+            for doctor_id in self.doctor_ids(int(params["specialityId"]))
+        ]
+
+    def lpu_schedule_info(self, params):
+        lpu_id = int(params["lpu_id"])
+        resources = []
+        for speciality_id in range(1, self.specialities + 1):
+            for doctor_id in self.doctor_ids(speciality_id):
+                if self.hospital_id(doctor_id) != lpu_id:
+                    continue
+                resources.append(
+                    {
+                        "id": str(doctor_id),
+                        "name": f"Врач {doctor_id}",
+                        "schedule": [
+                            {"date": day.isoformat(), "receptionInfo": "08:00-16:00"}
+                            for day in self.dates()
+                        ],
+                    }
+                )
+        return {"availableResource": resources}
+
+    def available_resource_schedule_info(self, params):
+        # The same resource gets the same slots unless churn is set.
+        seed = int(params["availableResourceId"])
+        if self.churn and self.random.random() < self.churn:
+            seed += int(time.time())
+        rng = random.Random(seed)
+        schedule = []
+        for day in self.dates():
+            start = datetime.combine(day, datetime.min.time()) + timedelta(hours=8)
+            minutes = sorted(rng.sample(range(0, 480, 15), self.slots_per_day))
+            schedule.append(
+                {
+                    "date": day.isoformat(),
+                    "scheduleBySlot": [
+                        {
+                            "slot": [
+                                {
+                                    "startTime": (
+                                        start + timedelta(minutes=minute)
+                                    ).strftime("%Y-%m-%dT%H:%M:%S+03:00")
+                                }
+                                for minute in minutes
+                            ]
+                        }
+                    ],
+                }
+            )
+        return {"scheduleOfDay": schedule}
+
+    def handle(self, request):
+        method = request.get("method")
+        with self.lock:
+            self.calls[method] += 1
+        handlers = {
+            "getSpecialitiesInfo": self.specialities_info,
+            "getDoctorsInfo": self.doctors_info,
+            "get_lpu_schedule_info": self.lpu_schedule_info,
+            "getAvailableResourceScheduleInfo": self.available_resource_schedule_info,
+        }
+        if method not in handlers:
+            return {
+                "jsonrpc": "2.0",
+                "id": request.get("id"),
+                "error": {"code": -32601, "message": "Method not found"},
+            }
+        return {
+            "jsonrpc": "2.0",
+            "id": request.get("id"),
+            "result": handlers[method](request.get("params", {})),
+        }
+
+    def start(self, host="127.0.0.1", port=0):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                # call counts for a server started in another process
+                if self.path.startswith("/calls"):
+                    with fake.lock:
+                        body = json.dumps(fake.calls).encode()
+                        if "reset" in self.path:
+                            fake.calls.clear()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                payload = json.loads(
+                    self.rfile.read(int(self.headers["Content-Length"]))
+                )
+                if fake.latency:
+                    time.sleep(fake.random.expovariate(1 / fake.latency))
+                if fake.random.random() < fake.error_rate:
+                    with fake.lock:
+                        fake.calls["errors"] += 1
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = json.dumps(fake.handle(payload)).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--specialities", type=int, default=10)
+    parser.add_argument("--doctors", type=int, default=20)
+    parser.add_argument("--hospitals", type=int, default=5)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--slots-per-day", type=int, default=16)
+    args = parser.parse_args()
+    fake = FakeEmias(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        specialities=args.specialities,
+        doctors=args.doctors,
+        hospitals=args.hospitals,
+        days=args.days,
+        slots_per_day=args.slots_per_day,
+    ).start(args.host, args.port)
+    print(f"fake EMIAS listening on {fake.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
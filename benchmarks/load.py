@@ -0,0 +1,407 @@
+"""Load scenarios against a local fake EMIAS (see benchmarks.fake_emias).
+
+routes drives /specialities, /doctors, the schedule page and
+current_available_time through the Flask test client from several threads;
+watcher runs one full scheduler tick over 1k/10k/100k active appointments.
+Both use a throwaway SQLite database and report p50/p99 latency,
+throughput, upstream calls per method and the peak RSS of each scenario
+with its growth over the RSS the scenario started at.
+
+    python -m benchmarks.load routes [--requests 200] [--concurrency 8]
+    python -m benchmarks.load watcher [--appointments 1000 10000 100000]
+
+Every request of routes comes from another patient, so the per-patient
+EMIAS calls are never cached.
+
+bulk registers --requests watches for one patient, first with one schedule
+form post each, then through POST /api/appointments in batches of
+APPOINTMENTS_BULK_LIMIT, each from a cold schedule cache.
+
+    python -m benchmarks.load bulk [--requests 500]
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from benchmarks.fake_emias import FakeEmias
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def proc_status_mb(field):
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+
+
+def start_rss():
+    # Every scenario runs in the same process, so the peak is reset before
+    # each one (Linux; elsewhere it stays the peak of the whole run). The
+    # current RSS is returned as the scenario's baseline.
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return proc_status_mb("VmRSS")
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    try:
+        return proc_status_mb("VmHWM")
+    except OSError:
+        # ru_maxrss is in kilobytes on Linux, bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def rss(baseline):
+    peak = peak_rss_mb()
+    return f"rss={peak:.0f}MB (+{peak - baseline:.0f}MB)"
+
+
+def report(name, timings, elapsed, calls, baseline):
+    upstream = ", ".join(f"{method}={count}" for method, count in sorted(calls.items()))
+    print(
+        f"{name:<24} n={len(timings):<6} p50={percentile(timings, 0.5) * 1000:8.1f}ms "
+        f"p99={percentile(timings, 0.99) * 1000:8.1f}ms "
+        f"{len(timings) / elapsed:8.1f} req/s  {rss(baseline)}  "
+        f"upstream: {upstream or '-'}"
+    )
+
+
+def serve_fake(fake, port):
+    fake.start(port=port)
+    threading.Event().wait()
+
+
+class FakeProcess:
+    # The fake runs in a process of its own, so that it does not compete
+    # with the app for the GIL; call counts are read over HTTP.
+    def __init__(self, fake):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        self.process = multiprocessing.Process(
+            target=serve_fake, args=(fake, port), daemon=True
+        )
+        self.process.start()
+        for _ in range(100):
+            try:
+                self.reset()
+                break
+            except OSError:
+                time.sleep(0.05)
+
+    def calls(self, path="/calls"):
+        with urllib.request.urlopen(self.url + path) as response:
+            return json.loads(response.read())
+
+    def reset(self):
+        return self.calls("/calls?reset=1")
+
+    def stop(self):
+        self.process.terminate()
+
+
+def setup_environment(args, server):
+    # app reads its configuration at import, so this runs first
+    directory = tempfile.mkdtemp(prefix="project_doctor_bench_")
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(directory, "bench.db")
+    os.environ["EMIAS_URL"] = server.url
+    os.environ["EMIAS_CACHE_BACKEND"] = "memory"
+    os.environ["EMIAS_RATE_LIMIT"] = str(args.rate_limit)
+    os.environ["EMIAS_RATE_BURST"] = str(args.rate_limit)
+    os.environ["WATCHER_BUDGET"] = str(10**6)
+    os.environ["WATCHER_DEADLINE"] = str(args.deadline)
+
+
+def create_users(count):
+    from app import db
+    from app.models import User
+
+    db.session.execute(
+        User.__table__.insert(),
+        [
+            {
+                "oms_number": f"{i:016d}",
+                "birth_date": date(1980, 1, 1) + timedelta(days=i % 10000),
+                "email": f"patient{i}@example.com",
+                "password_hash": "-",
+            }
+            for i in range(1, count + 1)
+        ],
+    )
+    db.session.commit()
+
+
+def reset_database():
+    from app import db
+
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+
+def run_routes(args, fake, server):
+    from app import app
+
+    print(f"concurrency {args.concurrency}")
+    reset_database()
+    create_users(args.requests)
+    tomorrow = (date.today() + timedelta(days=1)).isoformat()
+    doctor = 1000
+    hospital = fake.hospital_id(doctor)
+    scenarios = [
+        ("/specialities", "/specialities"),
+        ("/doctors", "/specialities/1/doctors"),
+        ("schedule", f"/specialities/1/doctors/{hospital}/{doctor}/schedule"),
+        (
+            "current_available_time",
+            f"/specialities/1/doctors/{hospital}/{doctor}/schedule"
+            f"/current_available_time?date={tomorrow}",
+        ),
+    ]
+    local = threading.local()
+
+    def get(request):
+        user_id, url = request
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user_id)
+            session["_fresh"] = True
+        started = time.perf_counter()
+        response = client.get(url)
+        response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f"{url}: {response.status_code}")
+        return time.perf_counter() - started
+
+    for name, url in scenarios:
+        server.reset()
+        requests = [(user_id, url) for user_id in range(1, args.requests + 1)]
+        baseline = start_rss()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            timings = list(executor.map(get, requests))
+        report(name, timings, time.perf_counter() - started, server.calls(), baseline)
+
+
+def create_appointments(count, fake):
+    from app import db
+    from app.models import Appointment
+
+    rng = random.Random(count)
+    days = fake.dates()
+    resources = [
+        (speciality_id, doctor_id)
+        for speciality_id in range(1, fake.specialities + 1)
+        for doctor_id in fake.doctor_ids(speciality_id)
+    ]
+    users = max(1, count // 20)
+    create_users(users)
+    rows = []
+    windows = set()
+    for i in range(count):
+        # a patient has at most one active watch per doctor and window
+        while True:
+            speciality_id, doctor_id = rng.choice(resources)
+            start = datetime.combine(rng.choice(days), datetime.min.time()) + timedelta(
+                hours=rng.randrange(7, 16)
+            )
+            end = start + timedelta(minutes=rng.choice((15, 60, 120)))
+            window = (i % users + 1, doctor_id, start, end)
+            if window not in windows:
+                windows.add(window)
+                break
+        rows.append(
+            {
+                "available_resource_id": doctor_id,
+                "speciality_id": speciality_id,
+                "doctor": f"Врач {doctor_id}",
+                "start_time": start,
+                "end_time": end,
+                "status": True,
+                "created_date": datetime.now(),
+                "user_id": window[0],
+            }
+        )
+        if len(rows) == 10000:
+            db.session.execute(Appointment.__table__.insert(), rows)
+            rows = []
+    if rows:
+        db.session.execute(Appointment.__table__.insert(), rows)
+    db.session.commit()
+
+
+def run_watcher(args, fake, server):
+    from app import app, db
+    from app.poller import queue
+    from app.watcher import scheduler
+
+    for count in args.appointments:
+        with app.app_context():
+            reset_database()
+            create_appointments(count, fake)
+            db.session.remove()
+        queue.states.clear()
+        queue.heap.clear()
+        server.reset()
+        baseline = start_rss()
+        started = time.perf_counter()
+        stats = scheduler()
+        elapsed = time.perf_counter() - started
+        report(f"scheduler tick {count}", [elapsed], elapsed, server.calls(), baseline)
+        print(
+            f"{'':<24} matched={stats['appointments_matched']} "
+            f"served={stats['appointments_served']}/{stats['appointments_active']} "
+            f"resources={stats['resources_due']} "
+            f"failed={stats['upstream_failed']} cancelled={stats['upstream_cancelled']}"
+        )
+
+
+def bulk_windows(count, fake):
+    # Distinct watches spread over every doctor (and so every hospital)
+    # before a doctor gets a second window.
+    hours = [f"{hour:02d}:00" for hour in range(8, 17)]
+    doctors = [
+        (speciality_id, doctor_id)
+        for speciality_id in range(1, fake.specialities + 1)
+        for doctor_id in fake.doctor_ids(speciality_id)
+    ]
+    windows = (
+        {
+            "speciality_id": speciality_id,
+            "hospital_id": fake.hospital_id(doctor_id),
+            "available_resource_id": doctor_id,
+            "date": day.isoformat(),
+            "start_time": start,
+            "end_time": end,
+        }
+        for day in fake.dates()
+        for start, end in itertools.combinations_with_replacement(hours, 2)
+        for speciality_id, doctor_id in doctors
+    )
+    return list(itertools.islice(windows, count))
+
+
+def run_bulk(args, fake, server):
+    from app import app
+    from app.routes import schedule_request
+
+    app.config["WTF_CSRF_ENABLED"] = False
+    windows = bulk_windows(args.requests, fake)
+    client = app.test_client()
+
+    def start():
+        reset_database()
+        create_users(1)
+        schedule_request.invalidate_prefix()
+        with client.session_transaction() as session:
+            session["_user_id"] = "1"
+            session["_fresh"] = True
+        server.reset()
+        return start_rss(), time.perf_counter()
+
+    baseline, started = start()
+    timings = []
+    for window in windows:
+        posted = time.perf_counter()
+        response = client.post(
+            f"/specialities/{window['speciality_id']}/doctors/"
+            f"{window['hospital_id']}/{window['available_resource_id']}/schedule",
+            data={
+                "date": window["date"],
+                "start_time": window["start_time"],
+                "end_time": window["end_time"],
+            },
+        )
+        if response.status_code != 302:
+            raise RuntimeError(f"form post: {response.status_code}")
+        timings.append(time.perf_counter() - posted)
+    elapsed = time.perf_counter() - started
+    report("form posts", timings, elapsed, server.calls(), baseline)
+
+    baseline, started = start()
+    limit = app.config["APPOINTMENTS_BULK_LIMIT"]
+    timings = []
+    created = 0
+    for i in range(0, len(windows), limit):
+        posted = time.perf_counter()
+        response = client.post(
+            "/api/appointments", json={"appointments": windows[i : i + limit]}
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"bulk post: {response.status_code}")
+        created += response.get_json()["created"]
+        timings.append(time.perf_counter() - posted)
+    elapsed = time.perf_counter() - started
+    report("bulk posts", timings, elapsed, server.calls(), baseline)
+    print(
+        f"{'':<24} created={created}/{len(windows)} "
+        f"{created / elapsed:8.1f} watches/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenario", choices=("routes", "watcher", "bulk"))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--appointments", type=int, nargs="+", default=[1000, 10000, 100000]
+    )
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--doctors", type=int, default=20)
+    parser.add_argument("--hospitals", type=int, default=5)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--slots-per-day", type=int, default=16)
+    parser.add_argument("--rate-limit", type=float, default=1000)
+    parser.add_argument("--deadline", type=int, default=600)
+    args = parser.parse_args()
+
+    fake = FakeEmias(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        doctors=args.doctors,
+        hospitals=args.hospitals,
+        days=args.days,
+        slots_per_day=args.slots_per_day,
+    )
+    server = FakeProcess(fake)
+    setup_environment(args, server)
+    try:
+        from app import app
+
+        with app.app_context():
+            if args.scenario == "routes":
+                run_routes(args, fake, server)
+            if args.scenario == "bulk":
+                run_bulk(args, fake, server)
+        if args.scenario == "watcher":
+            run_watcher(args, fake, server)
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
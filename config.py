@@ -1,11 +1,162 @@
 import os
 
+from sqlalchemy.pool import QueuePool
+
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
+def database_url():
+    url = os.environ.get("DATABASE_URL") or "sqlite:///" + os.path.join(
+        basedir, "app.db"
+    )
+    # Heroku-style URLs; SQLAlchemy 1.4 only accepts postgresql://
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://") :]
+    return url
+
+
+def engine_options(url, pool_size, max_overflow, pool_timeout, pool_recycle, pre_ping):
+    if url in ("sqlite://", "sqlite:///:memory:"):
+        return {}
+    pool = {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+    }
+    if url.startswith("sqlite"):
+        # SQLAlchemy 1.4 opens a new SQLite connection per checkout (and so
+        # runs the pragmas every time); keep a pool of them shared by threads
+        return {
+            **pool,
+            "poolclass": QueuePool,
+            "connect_args": {"check_same_thread": False},
+        }
+    return {**pool, "pool_recycle": pool_recycle, "pool_pre_ping": pre_ping}
+
+
 class Config(object):
     SECRET_KEY = os.environ.get("SECRET_KEY") or "you-will-never-guess"
-    SQLALCHEMY_DATABASE_URI = os.environ.get(
-        "DATABASE_URL"
-    ) or "sqlite:///" + os.path.join(basedir, "app.db")
+    SQLALCHEMY_DATABASE_URI = database_url()
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # connections kept open per process, and how many more may be opened
+    # under load before a request waits up to DATABASE_POOL_TIMEOUT seconds
+    DATABASE_POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE") or 10)
+    DATABASE_MAX_OVERFLOW = int(os.environ.get("DATABASE_MAX_OVERFLOW") or 10)
+    DATABASE_POOL_TIMEOUT = int(os.environ.get("DATABASE_POOL_TIMEOUT") or 30)
+    # server databases only: seconds before a connection is replaced, and
+    # whether it is checked before use (the server may have closed it)
+    DATABASE_POOL_RECYCLE = int(os.environ.get("DATABASE_POOL_RECYCLE") or 1800)
+    DATABASE_PRE_PING = (os.environ.get("DATABASE_PRE_PING") or "1") == "1"
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        SQLALCHEMY_DATABASE_URI,
+        pool_size=DATABASE_POOL_SIZE,
+        max_overflow=DATABASE_MAX_OVERFLOW,
+        pool_timeout=DATABASE_POOL_TIMEOUT,
+        pool_recycle=DATABASE_POOL_RECYCLE,
+        pre_ping=DATABASE_PRE_PING,
+    )
+    # milliseconds a SQLite writer waits for the lock before it fails with
+    # "database is locked"; NORMAL only risks the last commits on power loss
+    # once the database is in WAL mode
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get("SQLITE_BUSY_TIMEOUT") or 5000)
+    SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS") or "NORMAL"
+
+    # seconds an authenticated request may reuse its user without a query
+    USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL") or 60)
+    USER_CACHE_MAXSIZE = int(os.environ.get("USER_CACHE_MAXSIZE") or 10000)
+    # hashes made with another method are upgraded at the next login
+    PASSWORD_HASH_METHOD = (
+        os.environ.get("PASSWORD_HASH_METHOD") or "pbkdf2:sha256:260000"
+    )
+    # processes that hash passwords off the request threads; 0 hashes inline
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS") or 2)
+
+    EMIAS_URL = os.environ.get("EMIAS_URL") or "https://emias.info/api/new"
+    EMIAS_POOL_SIZE = int(os.environ.get("EMIAS_POOL_SIZE") or 20)
+    # (connect, read) seconds; per-method overrides in EMIAS_TIMEOUTS
+    EMIAS_TIMEOUT = (3.05, float(os.environ.get("EMIAS_TIMEOUT") or 10))
+    EMIAS_TIMEOUTS = {"get_lpu_schedule_info": (3.05, 20)}
+    EMIAS_RETRIES = int(os.environ.get("EMIAS_RETRIES") or 2)
+    EMIAS_BACKOFF = float(os.environ.get("EMIAS_BACKOFF") or 0.5)
+    # a method's circuit opens when at least EMIAS_BREAKER_THRESHOLD of its
+    # calls in the last EMIAS_BREAKER_WINDOW seconds failed (and there were
+    # EMIAS_BREAKER_MIN_CALLS); it lets a probe through after the cooldown
+    EMIAS_BREAKER_THRESHOLD = float(os.environ.get("EMIAS_BREAKER_THRESHOLD") or 0.5)
+    EMIAS_BREAKER_MIN_CALLS = int(os.environ.get("EMIAS_BREAKER_MIN_CALLS") or 10)
+    EMIAS_BREAKER_WINDOW = int(os.environ.get("EMIAS_BREAKER_WINDOW") or 60)
+    EMIAS_BREAKER_COOLDOWN = int(os.environ.get("EMIAS_BREAKER_COOLDOWN") or 30)
+    # "memory" is per process, "sqlite" is shared by all workers on the host
+    EMIAS_CACHE_BACKEND = os.environ.get("EMIAS_CACHE_BACKEND") or "memory"
+    EMIAS_CACHE_PATH = os.environ.get("EMIAS_CACHE_PATH") or os.path.join(
+        basedir, "cache.db"
+    )
+    EMIAS_CACHE_MAXSIZE = int(os.environ.get("EMIAS_CACHE_MAXSIZE") or 2048)
+    # seconds an entry is fresh, per EMIAS method
+    EMIAS_CACHE_TTL = {
+        "get_lpu_schedule_info": 900,
+        "getSpecialitiesInfo": 3600,
+        "getDoctorsInfo": 900,
+    }
+    EMIAS_CACHE_DEFAULT_TTL = 300
+    # seconds past the TTL an entry is still served while it is refreshed
+    EMIAS_CACHE_STALE_TTL = int(os.environ.get("EMIAS_CACHE_STALE_TTL") or 3600)
+    EMIAS_RATE_LIMIT = float(os.environ.get("EMIAS_RATE_LIMIT") or 5)
+    EMIAS_RATE_BURST = int(os.environ.get("EMIAS_RATE_BURST") or 10)
+
+    SCHEDULE_PREFETCH_WORKERS = int(os.environ.get("SCHEDULE_PREFETCH_WORKERS") or 8)
+    # render the doctors list progressively as hospital schedules arrive
+    DOCTORS_STREAMING = bool(os.environ.get("DOCTORS_STREAMING"))
+
+    # how often the watcher looks for due resources, and how long a tick
+    # may run
+    WATCHER_INTERVAL = int(os.environ.get("WATCHER_INTERVAL") or 30)
+    WATCHER_DEADLINE = int(os.environ.get("WATCHER_DEADLINE") or 25)
+    # per-resource poll interval bounds, in seconds, and the upstream
+    # requests per minute the polling schedule may plan for
+    WATCHER_MIN_INTERVAL = int(os.environ.get("WATCHER_MIN_INTERVAL") or 60)
+    WATCHER_MAX_INTERVAL = int(os.environ.get("WATCHER_MAX_INTERVAL") or 1800)
+    WATCHER_BUDGET = int(os.environ.get("WATCHER_BUDGET") or 600)
+    # run one `flask watcher run` per shard; each polls the resources with
+    # available_resource_id % WATCHER_SHARDS == WATCHER_SHARD
+    WATCHER_SHARD = int(os.environ.get("WATCHER_SHARD") or 0)
+    WATCHER_SHARDS = int(os.environ.get("WATCHER_SHARDS") or 1)
+    WATCHER_CONCURRENCY = int(os.environ.get("WATCHER_CONCURRENCY") or 8)
+    # active watches read from the database and polled per batch
+    WATCHER_CHUNK_SIZE = int(os.environ.get("WATCHER_CHUNK_SIZE") or 1000)
+
+    # how often expired and fulfilled watches move to appointment_archive,
+    # and how many rows each transaction moves
+    ARCHIVE_INTERVAL = int(os.environ.get("ARCHIVE_INTERVAL") or 3600)
+    ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE") or 500)
+    # appointments per page of /user and /api/appointments
+    APPOINTMENTS_PAGE_SIZE = int(os.environ.get("APPOINTMENTS_PAGE_SIZE") or 50)
+    # entries one POST /api/appointments may create; the INSERT binds 8
+    # parameters per entry (SQLite allows 32766 since 3.32)
+    APPOINTMENTS_BULK_LIMIT = int(os.environ.get("APPOINTMENTS_BULK_LIMIT") or 500)
+
+    # log one JSON trace line per request (route, upstream calls, cache)
+    METRICS_TRACE = bool(os.environ.get("METRICS_TRACE"))
+    # processes sharing this directory (the workers of one web server, say)
+    # write their metrics there every METRICS_FLUSH_INTERVAL seconds and
+    # /metrics adds them all up; unset, each process reports its own
+    METRICS_DIR = os.environ.get("METRICS_DIR")
+    METRICS_FLUSH_INTERVAL = int(os.environ.get("METRICS_FLUSH_INTERVAL") or 5)
+    # when set, /metrics wants "Authorization: Bearer <token>"
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+    # address of the watcher's --metrics-port server
+    METRICS_HOST = os.environ.get("METRICS_HOST") or "127.0.0.1"
+
+    MAIL_SERVER = os.environ.get("MAIL_SERVER") or "smtp.gmail.com"
+    MAIL_PORT = int(os.environ.get("MAIL_PORT") or 465)
+    MAIL_USE_SSL = (os.environ.get("MAIL_USE_SSL") or "1") == "1"
+    MAIL_USE_TLS = os.environ.get("MAIL_USE_TLS") == "1"
+    MAIL_USERNAME = os.environ.get("EMAIL_ADDRESS")
+    MAIL_PASSWORD = os.environ.get("EMAIL_PASSWORD")
+    MAIL_SENDER = os.environ.get("MAIL_SENDER") or "kharitonova.si16@physics.msu.ru"
+
+    OUTBOX_INTERVAL = int(os.environ.get("OUTBOX_INTERVAL") or 30)
+    OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE") or 100)
+    OUTBOX_CONCURRENCY = int(os.environ.get("OUTBOX_CONCURRENCY") or 2)
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS") or 5)
+    # seconds before the first retry, doubled on every further attempt
+    OUTBOX_BACKOFF = int(os.environ.get("OUTBOX_BACKOFF") or 60)
@@ -0,0 +1,40 @@
+"""appointment active indexes
+
+Revision ID: 6e0b7d2a9f48
+Revises: 2f6a8b0c4d13
+Create Date: 2026-10-18 13:05:51.902716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "6e0b7d2a9f48"
+down_revision = "2f6a8b0c4d13"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_appointment_active_resource",
+        "appointment",
+        ["speciality_id", "available_resource_id"],
+        unique=False,
+        sqlite_where=sa.text("status = 1"),
+        postgresql_where=sa.text("status"),
+    )
+    op.create_index(
+        "ix_appointment_active_user",
+        "appointment",
+        ["user_id", "start_time"],
+        unique=False,
+        sqlite_where=sa.text("status = 1"),
+        postgresql_where=sa.text("status"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_appointment_active_user", table_name="appointment")
+    op.drop_index("ix_appointment_active_resource", table_name="appointment")
@@ -0,0 +1,56 @@
+"""appointment active window
+
+Revision ID: d3a9f1c6e820
+Revises: b7e4c2d9a315
+Create Date: 2026-10-18 17:05:41.208316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d3a9f1c6e820"
+down_revision = "b7e4c2d9a315"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # retire duplicate active watches, keeping the oldest, before the index
+    appointment = sa.table(
+        "appointment",
+        sa.column("id", sa.Integer),
+        sa.column("user_id", sa.Integer),
+        sa.column("available_resource_id", sa.Integer),
+        sa.column("start_time", sa.DateTime),
+        sa.column("end_time", sa.DateTime),
+        sa.column("status", sa.Boolean),
+    )
+    first = (
+        sa.select(sa.func.min(appointment.c.id))
+        .where(appointment.c.status == sa.true())
+        .group_by(
+            appointment.c.user_id,
+            appointment.c.available_resource_id,
+            appointment.c.start_time,
+            appointment.c.end_time,
+        )
+    )
+    op.execute(
+        appointment.update()
+        .where(appointment.c.status == sa.true(), appointment.c.id.not_in(first))
+        .values(status=False)
+    )
+    op.create_index(
+        "ix_appointment_active_window",
+        "appointment",
+        ["user_id", "available_resource_id", "start_time", "end_time"],
+        unique=True,
+        sqlite_where=sa.text("status = 1"),
+        postgresql_where=sa.text("status"),
+    )
+
+
+def downgrade():
+    op.drop_index("ix_appointment_active_window", table_name="appointment")
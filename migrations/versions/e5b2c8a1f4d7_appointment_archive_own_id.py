@@ -0,0 +1,58 @@
+"""appointment archive own id
+
+Revision ID: e5b2c8a1f4d7
+Revises: d3a9f1c6e820
+Create Date: 2026-10-18 18:12:37.550914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e5b2c8a1f4d7"
+down_revision = "d3a9f1c6e820"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The archive kept appointment.id as its primary key, but SQLite gives a
+    # freed appointment id to the next watch; the old id moves to its own
+    # column and the archive numbers its rows itself.
+    op.add_column(
+        "appointment_archive", sa.Column("appointment_id", sa.Integer(), nullable=True)
+    )
+    op.execute("UPDATE appointment_archive SET appointment_id = id")
+    with op.batch_alter_table("appointment_archive") as batch_op:
+        batch_op.alter_column(
+            "appointment_id", existing_type=sa.Integer(), nullable=False
+        )
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute(
+            "CREATE SEQUENCE appointment_archive_id_seq "
+            "OWNED BY appointment_archive.id"
+        )
+        op.execute(
+            "SELECT setval('appointment_archive_id_seq', "
+            "COALESCE((SELECT max(id) FROM appointment_archive), 0) + 1, false)"
+        )
+        op.execute(
+            "ALTER TABLE appointment_archive ALTER COLUMN id "
+            "SET DEFAULT nextval('appointment_archive_id_seq')"
+        )
+
+
+def downgrade():
+    # one row per old id, the latest archived one
+    op.execute(
+        "DELETE FROM appointment_archive WHERE id NOT IN "
+        "(SELECT max(id) FROM appointment_archive GROUP BY appointment_id)"
+    )
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("ALTER TABLE appointment_archive ALTER COLUMN id DROP DEFAULT")
+        op.execute("DROP SEQUENCE appointment_archive_id_seq")
+    op.execute("UPDATE appointment_archive SET id = -appointment_id")
+    op.execute("UPDATE appointment_archive SET id = -id")
+    with op.batch_alter_table("appointment_archive") as batch_op:
+        batch_op.drop_column("appointment_id")
@@ -1,10 +1,15 @@
 from app import app, db
-from app.models import User, Appointment
+from app.models import User, Appointment, Notification
 
 
 @app.shell_context_processor
 def make_shell_context():
-    return {"db": db, "User": User, "Appointment": Appointment}
+    return {
+        "db": db,
+        "User": User,
+        "Appointment": Appointment,
+        "Notification": Notification,
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,42 @@
+import os
+from datetime import date
+
+import pytest
+
+# app reads its configuration at import; keep the tests off app.db
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("PASSWORD_HASH_WORKERS", "0")
+
+from app import app, db  # noqa: E402
+from app.models import User, user_cache  # noqa: E402
+
+
+@pytest.fixture
+def database(monkeypatch):
+    # an empty in-memory database with one patient, user 1
+    monkeypatch.setitem(app.config, "WTF_CSRF_ENABLED", False)
+    with app.app_context():
+        db.create_all()
+        db.session.add(
+            User(
+                id=1,
+                email="patient@example.com",
+                oms_number="1234567890123456",
+                birth_date=date(1990, 1, 1),
+            )
+        )
+        db.session.commit()
+        yield db
+        db.session.remove()
+        db.drop_all()
+    user_cache.clear()
+
+
+@pytest.fixture
+def client(database):
+    # a test client logged in as user 1
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = "1"
+        session["_fresh"] = True
+    return client
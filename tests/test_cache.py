@@ -0,0 +1,160 @@
+import threading
+import time
+
+import pytest
+
+from app import metrics
+from app.breaker import Unavailable
+from app.cache import EmiasCache, MemoryBackend, SQLiteBackend
+
+
+def make_cache(backend=None):
+    return EmiasCache(
+        backend=backend or MemoryBackend(10), ttls={}, default_ttl=60, stale_ttl=60
+    )
+
+
+def requests(method, result):
+    return metrics.cache_requests.snapshot().get((method, result), 0)
+
+
+def evictions(backend):
+    return metrics.cache_evictions.snapshot().get((backend,), 0)
+
+
+def test_concurrent_misses_share_one_call():
+    cache = make_cache()
+    release = threading.Event()
+    calls = []
+
+    @cache.cached("single_flight")
+    def load(patient):
+        calls.append(patient)
+        release.wait(5)
+        return {"patient": patient}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(load("1"))) for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    while len(cache.flights) == 0:
+        time.sleep(0.001)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == ["1"]
+    assert results == [{"patient": "1"}] * 5
+    assert load("1") == {"patient": "1"}
+    assert calls == ["1"]
+
+
+def test_followers_get_the_leaders_error():
+    cache = make_cache()
+    release = threading.Event()
+
+    @cache.cached("single_flight_error")
+    def load(patient):
+        release.wait(5)
+        raise ValueError("Неверный полис")
+
+    errors = []
+
+    def call():
+        try:
+            load("1")
+        except ValueError as error:
+            errors.append(str(error))
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    while len(cache.flights) == 0:
+        time.sleep(0.001)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert errors == ["Неверный полис"] * 3
+    # an error is not cached
+    assert cache.backend.get("single_flight_error:1") is None
+
+
+def test_stale_entries_are_served_and_refreshed_in_the_background():
+    cache = make_cache()
+    refreshed = threading.Event()
+
+    @cache.cached("stale")
+    def load(patient):
+        refreshed.set()
+        return "fresh"
+
+    cache.backend.set("stale:1", "old", time.time() - 90)
+    refreshes = metrics.cache_refreshes.snapshot().get(("stale",), 0)
+    assert load("1") == "old"
+    assert refreshed.wait(5)
+    for _ in range(500):
+        if cache.backend.get("stale:1")[1] == "fresh":
+            break
+        time.sleep(0.01)
+    assert load("1") == "fresh"
+    assert requests("stale", "stale") == 1
+    assert requests("stale", "hit") == 1
+    assert metrics.cache_refreshes.snapshot()[("stale",)] == refreshes + 1
+
+
+def test_expired_entries_are_a_fallback_only_while_emias_is_unavailable():
+    cache = make_cache()
+    error = Unavailable()
+
+    @cache.cached("fallback")
+    def load(patient):
+        raise error
+
+    cache.backend.set("fallback:1", "last known", time.time() - 3600)
+    assert load("1") == "last known"
+    assert requests("fallback", "fallback") == 1
+
+    # an error about the request itself is not hidden
+    error = ValueError("Неверный полис")
+    with pytest.raises(ValueError, match="Неверный полис"):
+        load("1")
+    # nothing to fall back to
+    error = Unavailable()
+    with pytest.raises(Unavailable):
+        load("2")
+
+
+def test_memory_backend_evicts_the_least_recently_used():
+    backend = MemoryBackend(2)
+    before = evictions("memory")
+    backend.set("a", 1, 0)
+    backend.set("b", 2, 0)
+    backend.get("a")
+    backend.set("c", 3, 0)
+    assert backend.get("b") is None
+    assert backend.get("a") == (0, 1)
+    assert evictions("memory") == before + 1
+
+
+def test_sqlite_backend_is_shared_and_evicts_the_oldest(tmp_path):
+    path = str(tmp_path / "cache.db")
+    backend = SQLiteBackend(path, maxsize=2)
+    # another worker process on the host
+    other = SQLiteBackend(path, maxsize=2)
+    before = evictions("sqlite")
+
+    backend.set("getDoctorsInfo:1:1990-01-01:1", [{"id": 1000}], 10)
+    assert other.get("getDoctorsInfo:1:1990-01-01:1") == (10, [{"id": 1000}])
+    other.set("getDoctorsInfo:1:1990-01-01:2", [], 20)
+    other.set("getSpecialitiesInfo:1:1990-01-01", [{"code": 1}], 30)
+    assert backend.get("getDoctorsInfo:1:1990-01-01:1") is None
+    assert evictions("sqlite") == before + 1
+
+    backend.delete_prefix("getDoctorsInfo:1:")
+    assert other.get("getDoctorsInfo:1:1990-01-01:2") is None
+    assert other.get("getSpecialitiesInfo:1:1990-01-01") == (30, [{"code": 1}])
+    backend.delete("getSpecialitiesInfo:1:1990-01-01")
+    assert other.get("getSpecialitiesInfo:1:1990-01-01") is None
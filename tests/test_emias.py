@@ -0,0 +1,81 @@
+import pytest
+import requests
+
+from app import emias
+from app.breaker import Breakers, Unavailable
+
+
+@pytest.fixture
+def breakers(monkeypatch):
+    breakers = Breakers(threshold=0.5, min_calls=2, window=60, cooldown=30)
+    monkeypatch.setattr(emias, "breakers", breakers)
+    return breakers
+
+
+def test_unexpected_exceptions_count_as_failures(breakers):
+    for _ in range(2):
+        with pytest.raises(KeyError):
+            with emias.measure("getDoctorsInfo"):
+                raise KeyError("result")
+    assert breakers["getDoctorsInfo"].rejecting()
+
+
+def test_reported_errors_do_not_open_the_circuit(breakers):
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            with emias.measure("getDoctorsInfo"):
+                raise ValueError("Неверный номер полиса")
+    assert not breakers["getDoctorsInfo"].rejecting()
+
+
+def test_post_turns_transport_errors_into_unavailable(monkeypatch):
+    client = emias.EmiasClient(
+        url="http://emias.test",
+        pool_size=1,
+        timeout=(1, 1),
+        timeouts={},
+        retries=1,
+        backoff=0,
+    )
+    attempts = []
+
+    def post(*args, **kwargs):
+        attempts.append(1)
+        raise requests.exceptions.ChunkedEncodingError("cut short")
+
+    monkeypatch.setattr(client.session, "post", post)
+    with pytest.raises(Unavailable):
+        client.post("getDoctorsInfo", {})
+    assert len(attempts) == 2
+
+
+class Response:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.payload = payload
+
+    def json(self):
+        if self.payload is None:
+            raise ValueError("not JSON")
+        return self.payload
+
+
+@pytest.mark.parametrize("status_code", [429, 500, 502, 503])
+def test_server_errors_are_unavailable(status_code):
+    with pytest.raises(Unavailable):
+        emias.check_error(Response(status_code))
+
+
+@pytest.mark.parametrize("status_code", [400, 401, 404])
+def test_client_errors_are_plain_errors(status_code):
+    with pytest.raises(ValueError) as error:
+        emias.check_error(Response(status_code))
+    assert not isinstance(error.value, Unavailable)
+
+
+def test_check_error_returns_the_payload_or_its_error():
+    assert emias.check_error(Response(200, {"result": []})) == {"result": []}
+    with pytest.raises(ValueError, match="Неверный полис"):
+        emias.check_error(Response(200, {"error": {"message": "Неверный полис"}}))
+    with pytest.raises(Unavailable):
+        emias.check_error(Response(200))
@@ -0,0 +1,132 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+from app.matching import SlotSnapshot, match_slots, slot_minutes, to_minutes
+
+
+def watch(start, end):
+    return SimpleNamespace(start_time=start, end_time=end)
+
+
+def minutes(*start_times):
+    return [slot_minutes(start_time) for start_time in start_times]
+
+
+def test_slot_minutes_ignores_the_offset():
+    assert slot_minutes("2022-01-24T08:30:00+03:00") == to_minutes(
+        datetime(2022, 1, 24, 8, 30)
+    )
+
+
+def test_match_slots_takes_the_earliest_slot_in_the_window():
+    slots = minutes("2022-01-24T08:00:00+03:00", "2022-01-24T09:30:00+03:00")
+    early = watch(datetime(2022, 1, 24, 7), datetime(2022, 1, 24, 10))
+    late = watch(datetime(2022, 1, 24, 9), datetime(2022, 1, 24, 10))
+    assert match_slots(slots, [early, late]) == [
+        (early, datetime(2022, 1, 24, 8)),
+        (late, datetime(2022, 1, 24, 9, 30)),
+    ]
+
+
+def test_match_slots_window_bounds_are_inclusive():
+    slots = minutes("2022-01-24T09:00:00+03:00")
+    assert match_slots(
+        slots, [watch(datetime(2022, 1, 24, 9), datetime(2022, 1, 24, 9))]
+    )
+    assert not match_slots(
+        slots, [watch(datetime(2022, 1, 24, 9, 1), datetime(2022, 1, 24, 12))]
+    )
+    assert not match_slots(
+        slots, [watch(datetime(2022, 1, 24, 7), datetime(2022, 1, 24, 8, 59))]
+    )
+    assert not match_slots([], [watch(datetime(2022, 1, 24), datetime(2022, 1, 25))])
+
+
+def test_first_update_reports_every_slot_as_new():
+    snapshot = SlotSnapshot()
+    seen_at = datetime(2022, 1, 20)
+    changed, new_slots, previous_seen_at = snapshot.update(
+        ["2022-01-24T09:00:00+03:00", "2022-01-24T08:00:00+03:00"], seen_at
+    )
+    assert changed
+    assert list(new_slots) == minutes(
+        "2022-01-24T08:00:00+03:00", "2022-01-24T09:00:00+03:00"
+    )
+    assert previous_seen_at is None
+    assert list(snapshot.slots) == list(new_slots)
+    assert snapshot.seen_at == seen_at
+
+
+def test_update_reports_only_the_slots_that_appeared():
+    snapshot = SlotSnapshot()
+    snapshot.update(["2022-01-24T08:00:00+03:00"], datetime(2022, 1, 20))
+    changed, new_slots, previous_seen_at = snapshot.update(
+        ["2022-01-24T08:00:00+03:00", "2022-01-24T10:00:00+03:00"],
+        datetime(2022, 1, 21),
+    )
+    assert changed
+    assert list(new_slots) == minutes("2022-01-24T10:00:00+03:00")
+    assert previous_seen_at == datetime(2022, 1, 20)
+    assert list(snapshot.slots) == minutes(
+        "2022-01-24T08:00:00+03:00", "2022-01-24T10:00:00+03:00"
+    )
+
+
+def test_same_slots_in_another_order_are_unchanged():
+    snapshot = SlotSnapshot()
+    snapshot.update(
+        ["2022-01-24T08:00:00+03:00", "2022-01-24T10:00:00+03:00"],
+        datetime(2022, 1, 20),
+    )
+    changed, new_slots, previous_seen_at = snapshot.update(
+        [
+            "2022-01-24T10:00:00+03:00",
+            "2022-01-24T08:00:00+03:00",
+            "2022-01-24T08:00:00+03:00",
+        ],
+        datetime(2022, 1, 21),
+    )
+    assert not changed
+    assert not new_slots
+    assert previous_seen_at == datetime(2022, 1, 20)
+    assert snapshot.seen_at == datetime(2022, 1, 21)
+
+
+def test_removed_slots_change_the_snapshot_without_new_slots():
+    snapshot = SlotSnapshot()
+    snapshot.update(
+        ["2022-01-24T08:00:00+03:00", "2022-01-24T10:00:00+03:00"],
+        datetime(2022, 1, 20),
+    )
+    changed, new_slots, _ = snapshot.update(
+        ["2022-01-24T10:00:00+03:00"], datetime(2022, 1, 21)
+    )
+    assert changed
+    assert not new_slots
+    assert list(snapshot.slots) == minutes("2022-01-24T10:00:00+03:00")
+
+
+def test_diff_leaves_the_snapshot_alone_until_applied():
+    snapshot = SlotSnapshot()
+    snapshot.update(["2022-01-24T08:00:00+03:00"], datetime(2022, 1, 20))
+    update = snapshot.diff(
+        ["2022-01-24T08:00:00+03:00", "2022-01-24T10:00:00+03:00"],
+        datetime(2022, 1, 21),
+    )
+    assert update.changed
+    assert snapshot.seen_at == datetime(2022, 1, 20)
+    assert list(snapshot.slots) == minutes("2022-01-24T08:00:00+03:00")
+
+    # not applied, as after a failed commit: the slot is still new next time
+    retry = snapshot.diff(
+        ["2022-01-24T08:00:00+03:00", "2022-01-24T10:00:00+03:00"],
+        datetime(2022, 1, 22),
+    )
+    assert list(retry.new_slots) == minutes("2022-01-24T10:00:00+03:00")
+    assert retry.previous_seen_at == datetime(2022, 1, 20)
+
+    retry.apply()
+    assert snapshot.seen_at == datetime(2022, 1, 22)
+    assert list(snapshot.slots) == minutes(
+        "2022-01-24T08:00:00+03:00", "2022-01-24T10:00:00+03:00"
+    )
@@ -0,0 +1,77 @@
+import json
+import os
+import urllib.error
+import urllib.request
+
+from app import app, metrics
+from app.metrics import MultiprocessStore, Registry
+
+
+def make_registry():
+    registry = Registry()
+    calls = registry.counter("calls_total", "Calls.", ("method",))
+    duration = registry.histogram("duration_seconds", "Duration.", buckets=(0.1, 1))
+    return registry, calls, duration
+
+
+def test_render_adds_up_every_process(tmp_path):
+    registry, calls, duration = make_registry()
+    registry.store = MultiprocessStore(registry, str(tmp_path), interval=60)
+    calls.inc(method="a")
+    duration.observe(0.05)
+
+    # what another worker wrote
+    other, other_calls, other_duration = make_registry()
+    other_calls.inc(2, method="a")
+    other_calls.inc(method="b")
+    other_duration.observe(0.5)
+    (tmp_path / "1-other.json").write_text(json.dumps(other.snapshot()))
+
+    text = registry.render()
+    assert 'calls_total{method="a"} 3' in text
+    assert 'calls_total{method="b"} 1' in text
+    assert 'duration_seconds_bucket{le="0.1"} 1' in text
+    assert 'duration_seconds_bucket{le="1.0"} 2' in text
+    assert "duration_seconds_count 2" in text
+    assert "duration_seconds_sum 0.55" in text
+    # this process wrote its own file
+    assert len(list(tmp_path.glob("*.json"))) == 2
+    assert registry.store.pid == os.getpid()
+
+
+def test_render_without_a_store_reports_this_process():
+    registry, calls, _ = make_registry()
+    calls.inc(method="a")
+    assert 'calls_total{method="a"} 1' in registry.render()
+
+
+def scrape(url, token=None):
+    request = urllib.request.Request(url)
+    if token:
+        request.add_header("Authorization", f"Bearer {token}")
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+def test_serve_listens_locally_and_wants_the_token():
+    server = metrics.serve(0, token="secret")
+    try:
+        host, port = server.server_address
+        assert host == "127.0.0.1"
+        url = f"http://127.0.0.1:{port}/metrics"
+        assert scrape(url) == 401
+        assert scrape(url, "wrong") == 401
+        assert scrape(url, "secret") == 200
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_metrics_view_wants_the_token(client, monkeypatch):
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", "secret")
+    assert client.get("/metrics").status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
@@ -0,0 +1,112 @@
+import socket
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from app.models import Notification
+from app.outbox import OutboxSender
+
+
+class Sink:
+    # aiosmtpd handler: keeps every delivered message and refuses the
+    # recipients starting with "refused"
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("refused"):
+            return "550 mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((envelope.rcpt_tos, envelope.content.decode()))
+        return "250 Message accepted for delivery"
+
+
+@pytest.fixture
+def sink():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    sink = Sink()
+    controller = Controller(sink, hostname="127.0.0.1", port=port)
+    controller.start()
+    sink.port = port
+    yield sink
+    controller.stop()
+
+
+def make_sender(port, max_attempts=3):
+    return OutboxSender(
+        server="127.0.0.1",
+        port=port,
+        use_ssl=False,
+        use_tls=False,
+        username=None,
+        password=None,
+        sender="watcher@example.com",
+        batch_size=10,
+        concurrency=2,
+        max_attempts=max_attempts,
+        backoff=60,
+    )
+
+
+def queue(database, *recipients):
+    for i, recipient in enumerate(recipients):
+        database.session.add(
+            Notification(
+                appointment_id=i + 1,
+                recipient=recipient,
+                subject="Новая запись",
+                body=f"Запись: Врач {i + 1}",
+            )
+        )
+    database.session.commit()
+
+
+def retry_delay(row):
+    return (row.next_attempt_at - datetime.now()).total_seconds()
+
+
+def test_pending_notifications_are_sent(database, sink):
+    queue(database, "a@example.com", "b@example.com", "c@example.com")
+
+    assert make_sender(sink.port).send_pending() == {"sent": 3, "failed": 0}
+    assert sorted(rcpt_tos[0] for rcpt_tos, _ in sink.messages) == [
+        "a@example.com",
+        "b@example.com",
+        "c@example.com",
+    ]
+    assert all("Subject: =?utf-8?" in content for _, content in sink.messages)
+    assert {row.status for row in Notification.query} == {"sent"}
+    assert make_sender(sink.port).send_pending() == {"sent": 0, "failed": 0}
+
+
+def test_refused_recipient_is_retried_with_backoff_then_failed(database, sink):
+    queue(database, "a@example.com", "refused@example.com")
+    sender = make_sender(sink.port, max_attempts=3)
+
+    assert sender.send_pending() == {"sent": 1, "failed": 1}
+    refused = Notification.query.filter_by(recipient="refused@example.com").one()
+    assert (refused.status, refused.attempts) == ("pending", 1)
+    assert "550" in refused.last_error
+    # backoff * 2 ** (attempts - 1), jittered down to half of it
+    assert 30 - 1 <= retry_delay(refused) <= 60
+    # not due yet
+    assert sender.send_pending() == {"sent": 0, "failed": 0}
+
+    refused.next_attempt_at = datetime.now() - timedelta(seconds=1)
+    database.session.commit()
+    assert sender.send_pending() == {"sent": 0, "failed": 1}
+    assert (refused.status, refused.attempts) == ("pending", 2)
+    assert 60 - 1 <= retry_delay(refused) <= 120
+
+    refused.next_attempt_at = datetime.now() - timedelta(seconds=1)
+    database.session.commit()
+    assert sender.send_pending() == {"sent": 0, "failed": 1}
+    assert (refused.status, refused.attempts) == ("failed", 3)
+    assert sender.send_pending() == {"sent": 0, "failed": 0}
+    assert len(sink.messages) == 1
@@ -0,0 +1,116 @@
+import time
+from datetime import datetime, timedelta
+
+from app.poller import PollEngine, PollQueue
+
+
+def make_queue(min_interval=60, max_interval=1800, budget=6000):
+    return PollQueue(min_interval, max_interval, budget)
+
+
+def soon(days):
+    return datetime.now() + timedelta(days=days)
+
+
+def test_new_resources_are_due_at_once():
+    queue = make_queue()
+    queue.sync({(1, 10): soon(30), (1, 11): soon(30)}, now=100)
+    assert sorted(queue.due(100, cost=1)) == [(1, 10), (1, 11)]
+    assert queue.due(100, cost=1) == []
+
+
+def test_due_keys_leave_the_heap_until_rescheduled():
+    queue = make_queue()
+    queue.sync({(1, 10): soon(30)}, now=100)
+    assert queue.due(100, cost=1) == [(1, 10)]
+    assert queue.heap == []
+    # sync does not push known resources again
+    queue.sync({(1, 10): soon(30)}, now=200)
+    assert queue.heap == []
+    queue.reschedule((1, 10), 200, None)
+    assert len(queue.heap) == 1
+
+
+def test_resources_gone_from_sync_retire():
+    queue = make_queue()
+    queue.sync({(1, 10): soon(30), (1, 11): soon(30)}, now=100)
+    queue.sync({(1, 11): soon(30)}, now=100)
+    assert queue.due(100, cost=1) == [(1, 11)]
+    assert list(queue.states) == [(1, 11)]
+
+
+def test_due_stops_at_the_budget():
+    queue = make_queue(budget=3)
+    queue.sync({(1, key): soon(30) for key in range(5)}, now=100)
+    assert len(queue.due(100, cost=1)) == 3
+    # the rest stay on the heap for the next tick
+    assert len(queue.heap) == 2
+
+
+def test_interval_grows_with_the_lead_time():
+    queue = make_queue(min_interval=60, max_interval=10**6)
+    queue.sync(
+        {(1, 1): soon(0.5), (1, 2): soon(2), (1, 3): soon(5), (1, 4): soon(30)},
+        now=0,
+    )
+    intervals = [queue.interval(queue.states[(1, key)]) for key in (1, 2, 3, 4)]
+    assert intervals == [60, 120, 300, 900]
+
+
+def test_unchanged_polls_back_off_and_a_change_resets():
+    queue = make_queue(min_interval=60, max_interval=1800)
+    queue.sync({(1, 10): soon(0.5)}, now=0)
+    state = queue.states[(1, 10)]
+    queue.due(0, cost=1)
+    queue.reschedule((1, 10), 0, False)
+    assert state.backoff == 2
+    assert state.next_poll == 120
+    for _ in range(10):
+        queue.reschedule((1, 10), 0, False)
+    assert state.backoff == 30
+    assert state.next_poll == 1800
+    queue.reschedule((1, 10), 0, True)
+    assert state.backoff == 1
+    assert state.next_poll == 60
+
+
+def test_a_failed_poll_keeps_the_backoff():
+    queue = make_queue()
+    queue.sync({(1, 10): soon(0.5)}, now=0)
+    state = queue.states[(1, 10)]
+    queue.reschedule((1, 10), 0, False)
+    queue.reschedule((1, 10), 0, None)
+    assert state.backoff == 2
+
+
+def test_stale_heap_entries_are_skipped():
+    queue = make_queue()
+    queue.sync({(1, 10): soon(0.5)}, now=0)
+    queue.reschedule((1, 10), 0, True)
+    # the entry pushed by sync is outdated by the reschedule
+    assert len(queue.heap) == 2
+    assert queue.due(30, cost=1) == []
+    assert queue.due(60, cost=1) == [(1, 10)]
+    assert queue.heap == []
+
+
+def test_engine_counts_any_exception_as_a_failed_call():
+    def fetch(value):
+        if value == "index":
+            return [][0]
+        if value == "type":
+            return len(value) + value
+        return value
+
+    engine = PollEngine(max_workers=2, rate=1000, burst=1000)
+    results, stats = engine.run(
+        {
+            "ok": (fetch, {"value": 1}),
+            "index": (fetch, {"value": "index"}),
+            "type": (fetch, {"value": "type"}),
+        },
+        "http://emias.test",
+        time.monotonic() + 5,
+    )
+    assert results == {"ok": 1}
+    assert stats == {"calls": 3, "failed": 2, "cancelled": 0}
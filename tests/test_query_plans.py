@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# PostgreSQL is checked only when a scratch database is given, e.g.
+# TEST_POSTGRES_URL=postgresql://localhost/doctor_test; its tables are
+# dropped and migrated again.
+POSTGRES_URL = os.environ.get("TEST_POSTGRES_URL")
+
+
+def flask(database_url, *args):
+    # The engine is configured at import, so every database gets its own
+    # process: migrations first, then the command itself.
+    env = {**os.environ, "DATABASE_URL": database_url, "FLASK_APP": "project_doctor.py"}
+    return subprocess.run(
+        [sys.executable, "-m", "flask", *args],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+
+
+@pytest.fixture(
+    params=[
+        "sqlite",
+        pytest.param(
+            "postgresql",
+            marks=pytest.mark.skipif(
+                not POSTGRES_URL, reason="TEST_POSTGRES_URL is not set"
+            ),
+        ),
+    ]
+)
+def database_url(request, tmp_path):
+    if request.param == "sqlite":
+        return "sqlite:///" + str(tmp_path / "plans.db")
+    assert flask(POSTGRES_URL, "db", "downgrade", "base").returncode == 0
+    return POSTGRES_URL
+
+
+def test_hot_queries_use_their_indexes(database_url):
+    migrated = flask(database_url, "db", "upgrade")
+    assert migrated.returncode == 0, migrated.stderr
+
+    checked = flask(database_url, "check-query-plans")
+    assert checked.returncode == 0, checked.stdout + checked.stderr
+    assert "watcher: ok" in checked.stdout
+    assert "/user: ok" in checked.stdout
+    assert "ix_appointment_active_resource" in checked.stdout
+    assert "ix_appointment_active_user" in checked.stdout
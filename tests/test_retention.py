@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+from app import app
+from app.models import Appointment, ArchivedAppointment
+from app.retention import archive_appointments
+
+
+def add_watch(db, start_time, status=True):
+    appointment = Appointment(
+        available_resource_id=1000,
+        speciality_id=1,
+        doctor="Врач 1000",
+        start_time=start_time,
+        end_time=start_time + timedelta(hours=1),
+        status=status,
+        user_id=1,
+    )
+    db.session.add(appointment)
+    db.session.commit()
+    return appointment.id
+
+
+def test_archive_moves_expired_and_matched_watches_in_batches(database, monkeypatch):
+    monkeypatch.setitem(app.config, "ARCHIVE_BATCH_SIZE", 2)
+    future = datetime.now() + timedelta(days=1)
+    past = datetime.now() - timedelta(days=1)
+    active = add_watch(database, future)
+    matched = add_watch(database, future + timedelta(hours=2), status=False)
+    expired = [add_watch(database, past - timedelta(hours=i)) for i in range(3)]
+
+    assert archive_appointments() == {"archived": 4, "batches": 2}
+    assert [row.id for row in Appointment.query] == [active]
+    archived = ArchivedAppointment.query.order_by(ArchivedAppointment.id).all()
+    assert [row.appointment_id for row in archived] == [matched] + expired
+    assert {row.status for row in archived} == {False}
+    assert archive_appointments() == {"archived": 0, "batches": 0}
+
+
+def test_archive_keeps_rows_whose_appointment_id_was_reused(database):
+    # SQLite gives the id of the archived last row to the next watch
+    past = datetime.now() - timedelta(days=1)
+    first = add_watch(database, past)
+    assert archive_appointments()["archived"] == 1
+    assert add_watch(database, past) == first
+
+    assert archive_appointments()["archived"] == 1
+    assert [row.appointment_id for row in ArchivedAppointment.query] == [first, first]
+    assert Appointment.query.count() == 0
@@ -0,0 +1,295 @@
+from datetime import datetime
+
+import pytest
+from flask_login import login_user
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import app, db, routes
+from app.models import Appointment, User
+from app.routes import index_schedule
+
+
+def test_index_schedule_skips_malformed_rows():
+    index = index_schedule(
+        [
+            {
+                "id": 1000,
+                "name": "Врач 1000",
+                "schedule": [
+                    {"date": "2022-01-24", "receptionInfo": "08:00-10:00"},
+                    {"date": "2022-01-25", "receptionInfo": "8 утра-10"},
+                    {"date": "2022-01-26", "receptionInfo": None},
+                    {"receptionInfo": "08:00-10:00"},
+                    {"date": "2022-01-27"},
+                ],
+            },
+            {"id": 1001, "name": "Врач 1001", "schedule": []},
+        ]
+    )
+    assert index["1000"]["time_arrangements"] == {
+        "2022-01-24": ["08:00", "09:00", "10:00"]
+    }
+    assert [row["date"] for row in index["1000"]["schedule"]] == ["2022-01-24"]
+    assert index["1001"]["schedule"] == []
+
+
+SCHEDULE = {
+    "resources": {
+        "1000": {
+            "name": "Врач 1000",
+            "time_arrangements": {"2030-01-24": ["08:00", "09:00", "10:00"]},
+        }
+    }
+}
+
+
+def window(available_resource_id=1000, start_time="08:00"):
+    return {
+        "speciality_id": 1,
+        "hospital_id": 1,
+        "available_resource_id": available_resource_id,
+        "date": "2030-01-24",
+        "start_time": start_time,
+        "end_time": "10:00",
+    }
+
+
+def test_fetch_schedules_maps_each_hospital_to_its_schedule_or_error(monkeypatch):
+    calls = []
+
+    def schedule_request(hospital_id):
+        calls.append(hospital_id)
+        if hospital_id == 2:
+            raise ValueError("Больница недоступна")
+        return SCHEDULE
+
+    monkeypatch.setattr(routes, "schedule_request", schedule_request)
+    with app.app_context():
+        schedules = routes.fetch_schedules([1, 2, 1])
+    assert sorted(calls) == [1, 2]
+    assert schedules[1] is SCHEDULE
+    assert str(schedules[2]) == "Больница недоступна"
+
+
+def test_current_available_time_revalidates_with_the_schedule_version(
+    client, monkeypatch
+):
+    rows = [
+        {
+            "id": 1000,
+            "name": "Врач 1000",
+            "schedule": [{"date": "2030-01-24", "receptionInfo": "08:00-10:00"}],
+        }
+    ]
+    monkeypatch.setattr(
+        routes, "schedule_request", lambda hospital_id: routes.build_schedule(rows)
+    )
+    url = "/specialities/1/doctors/1/1000/schedule/current_available_time"
+    query = {"date": "2030-01-24"}
+
+    response = client.get(url, query_string=query)
+    assert response.status_code == 200
+    assert response.get_json() == ["08:00", "09:00", "10:00"]
+    etag = response.headers["ETag"]
+    assert etag
+
+    response = client.get(url, query_string=query, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    rows[0]["schedule"][0]["receptionInfo"] = "08:00-09:00"
+    response = client.get(url, query_string=query, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json() == ["08:00", "09:00"]
+    assert response.headers["ETag"] != etag
+
+
+def test_bulk_rejects_watches_a_concurrent_request_created(client, monkeypatch):
+    monkeypatch.setattr(routes, "schedule_request", lambda hospital_id: SCHEDULE)
+    active_windows = routes.active_windows
+    stale = []
+
+    def racing_active_windows(user_id, keys):
+        # the first check misses the row another request inserts right after
+        if not stale:
+            stale.append(keys)
+            with Session(db.engine) as other:
+                other.add(
+                    Appointment(
+                        available_resource_id=1000,
+                        speciality_id=1,
+                        doctor="Врач 1000",
+                        start_time=datetime(2030, 1, 24, 8),
+                        end_time=datetime(2030, 1, 24, 10),
+                        user_id=1,
+                    )
+                )
+                other.commit()
+            return {}
+        return active_windows(user_id, keys)
+
+    monkeypatch.setattr(routes, "active_windows", racing_active_windows)
+    response = client.post(
+        "/api/appointments",
+        json={"appointments": [window(), window(start_time="09:00")]},
+    )
+    assert [result["status"] for result in response.json["results"]] == [
+        "rejected",
+        "created",
+    ]
+    assert response.json["results"][0]["error"] == "Такая запись уже есть"
+    assert Appointment.query.filter_by(status=True).count() == 2
+
+
+def test_api_appointments_pages_by_start_time_and_id(client, monkeypatch):
+    monkeypatch.setitem(app.config, "APPOINTMENTS_PAGE_SIZE", 2)
+    # two watches share a start time, one is matched already
+    starts = [datetime(2030, 1, 24, hour) for hour in (10, 8, 9, 9, 11)]
+    for i, start_time in enumerate(starts):
+        db.session.add(
+            Appointment(
+                available_resource_id=1000 + i,
+                speciality_id=1,
+                doctor=f"Врач {1000 + i}",
+                start_time=start_time,
+                end_time=start_time.replace(hour=12),
+                status=i != 4,
+                user_id=1,
+            )
+        )
+    db.session.commit()
+
+    pages = []
+    after = None
+    while True:
+        response = client.get(
+            "/api/appointments", query_string={"after": after} if after else {}
+        )
+        assert response.status_code == 200
+        pages.append([row["id"] for row in response.json["appointments"]])
+        after = response.json["next"]
+        if after is None:
+            break
+    assert pages == [[2, 3], [4, 1]]
+    assert client.get("/api/appointments?after=yesterday").status_code == 400
+
+
+def test_user_page_links_to_the_next_page(client, monkeypatch):
+    monkeypatch.setitem(app.config, "APPOINTMENTS_PAGE_SIZE", 1)
+    for hour in (8, 9):
+        start_time = datetime(2030, 1, 24, hour)
+        db.session.add(
+            Appointment(
+                available_resource_id=1000,
+                speciality_id=1,
+                doctor=f"Врач {hour}",
+                start_time=start_time,
+                end_time=start_time.replace(hour=12),
+                user_id=1,
+            )
+        )
+    db.session.commit()
+
+    first = client.get("/user").get_data(as_text=True)
+    assert "Врач 8" in first and "Врач 9" not in first
+    assert "after=2030-01-24T08%3A00%3A00_1" in first
+    second = client.get("/user?after=2030-01-24T08:00:00_1").get_data(as_text=True)
+    assert "Врач 9" in second and "Врач 8" not in second
+    assert "В начало" in second and "Далее" not in second
+
+
+def test_bulk_creates_every_valid_watch(client, monkeypatch):
+    monkeypatch.setattr(routes, "schedule_request", lambda hospital_id: SCHEDULE)
+    response = client.post(
+        "/api/appointments",
+        json={"appointments": [window(), window(start_time="09:00")]},
+    )
+    assert response.status_code == 200
+    assert (response.json["created"], response.json["rejected"]) == (2, 0)
+    ids = [result["id"] for result in response.json["results"]]
+    rows = Appointment.query.order_by(Appointment.start_time).all()
+    assert [row.id for row in rows] == ids
+    assert [(row.doctor, row.start_time.hour) for row in rows] == [
+        ("Врач 1000", 8),
+        ("Врач 1000", 9),
+    ]
+
+
+def test_bulk_rejects_invalid_entries_one_by_one(client, monkeypatch):
+    def schedule_request(hospital_id):
+        if hospital_id == 2:
+            raise ValueError("ЕМИАС временно недоступен")
+        return SCHEDULE
+
+    monkeypatch.setattr(routes, "schedule_request", schedule_request)
+    client.post("/api/appointments", json={"appointments": [window()]})
+    items = [
+        {"date": "2030-01-24"},
+        {**window(), "end_time": "07:00"},
+        {**window(), "date": "2020-01-24"},
+        window(available_resource_id=1001),
+        {**window(), "date": "2030-01-25"},
+        window(start_time="07:00"),
+        {**window(start_time="09:00"), "hospital_id": 2},
+        window(),
+        window(start_time="09:00"),
+        window(start_time="09:00"),
+    ]
+    response = client.post("/api/appointments", json={"appointments": items})
+    assert [
+        result.get("error", result["status"]) for result in response.json["results"]
+    ] == [
+        "Неверный формат записи",
+        "Время начала позже времени окончания",
+        "Время записи уже прошло",
+        "Врач не найден в расписании больницы",
+        "Врач не принимает в этот день",
+        "Время вне расписания врача",
+        "ЕМИАС временно недоступен",
+        "Такая запись уже есть",
+        "created",
+        "Такая запись уже есть",
+    ]
+    assert Appointment.query.count() == 2
+
+    assert client.post("/api/appointments", json={}).status_code == 400
+    monkeypatch.setitem(app.config, "APPOINTMENTS_BULK_LIMIT", 1)
+    too_many = client.post("/api/appointments", json={"appointments": items[:2]})
+    assert too_many.status_code == 400
+
+
+def flashes(client):
+    with client.session_transaction() as session:
+        return [message for _, message in session.pop("_flashes", [])]
+
+
+def test_schedule_form_does_not_create_a_duplicate_watch(client, monkeypatch):
+    monkeypatch.setattr(
+        routes,
+        "get_schedule",
+        lambda hospital_id, available_resource_id: (
+            "Врач 1000",
+            [{"date": "2030-01-24", "time_arrangement": ["08:00", "09:00"]}],
+        ),
+    )
+    url = "/specialities/1/doctors/1/1000/schedule"
+    form = {"date": "2030-01-24", "start_time": "08:00", "end_time": "09:00"}
+    assert client.post(url, data=form).status_code == 302
+    assert flashes(client) == ["Ваша заявка принята! Ждите уведомления на почту."]
+    assert client.post(url, data=form).status_code == 302
+    assert flashes(client) == ["Такая заявка уже есть."]
+    assert Appointment.query.count() == 1
+
+
+def test_create_appointment_only_takes_a_duplicate_for_a_duplicate(database):
+    with app.test_request_context():
+        login_user(User.query.get(1))
+        with pytest.raises(IntegrityError):
+            routes.create_appointment(
+                available_resource_id=1000,
+                speciality_id=1,
+                doctor=None,
+                start_time=datetime(2030, 1, 24, 8),
+                end_time=datetime(2030, 1, 24, 9),
+            )
@@ -0,0 +1,77 @@
+from app import app, db, routes
+from app.models import User, forget_user, load_user, user_cache
+from app.passwords import hasher
+
+
+def test_load_user_serves_the_cached_row_until_forgotten(database):
+    with app.test_request_context():
+        assert load_user("1").email == "patient@example.com"
+        assert 1 in user_cache
+        db.session.execute(User.__table__.update().values(email="new@example.com"))
+        db.session.commit()
+        db.session.remove()
+        assert load_user("1").email == "patient@example.com"
+
+        forget_user("1")
+        assert load_user("1").email == "new@example.com"
+
+
+def test_edit_profile_forgets_the_cached_user(client, monkeypatch):
+    monkeypatch.setattr(hasher, "method", "pbkdf2:sha256:1000")
+    assert client.get("/edit_profile").status_code == 200
+    assert 1 in user_cache
+
+    response = client.post(
+        "/edit_profile",
+        data={
+            "oms_number": "1234567890123456",
+            "birth_date": "1990-01-01",
+            "email": "new@example.com",
+            "password": "secret",
+        },
+    )
+    assert response.status_code == 302
+    assert 1 not in user_cache
+    assert b"new@example.com" in client.get("/edit_profile").data
+    with app.app_context():
+        assert User.query.get(1).check_password("secret")
+
+
+def test_login_upgrades_a_hash_of_an_old_method(database, monkeypatch):
+    monkeypatch.setattr(routes, "warm_patient_cache", lambda *args: None)
+    monkeypatch.setattr(hasher, "method", "pbkdf2:sha256:1000")
+    user = User.query.get(1)
+    user.set_password("secret")
+    db.session.commit()
+
+    monkeypatch.setattr(hasher, "method", "pbkdf2:sha256:2000")
+    client = app.test_client()
+    response = client.post(
+        "/login", data={"email": "patient@example.com", "password": "secret"}
+    )
+    assert response.status_code == 302
+    db.session.remove()
+    user = User.query.get(1)
+    assert user.password_hash.startswith("pbkdf2:sha256:2000$")
+    assert user.check_password("secret")
+
+
+def test_login_keeps_a_current_hash(database, monkeypatch):
+    monkeypatch.setattr(routes, "warm_patient_cache", lambda *args: None)
+    monkeypatch.setattr(hasher, "method", "pbkdf2:sha256:1000")
+    user = User.query.get(1)
+    user.set_password("secret")
+    db.session.commit()
+    password_hash = user.password_hash
+
+    client = app.test_client()
+    response = client.post(
+        "/login", data={"email": "patient@example.com", "password": "wrong"}
+    )
+    assert response.status_code == 302
+    response = client.post(
+        "/login", data={"email": "patient@example.com", "password": "secret"}
+    )
+    assert response.status_code == 302
+    db.session.remove()
+    assert User.query.get(1).password_hash == password_hash
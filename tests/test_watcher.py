@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app import watcher
+from app.models import Appointment, Notification
+from app.poller import PollQueue
+
+SLOT_8 = "2022-01-24T08:00:00+03:00"
+SLOT_10 = "2022-01-24T10:00:00+03:00"
+KEY = (1, 1000)
+RESOURCE = (1000, 5)
+
+
+def make_watch(id, created_date, user_id=1):
+    return SimpleNamespace(
+        id=id,
+        user_id=user_id,
+        oms_number=str(user_id) * 16,
+        birth_date=None,
+        start_time=datetime(2022, 1, 24, 7),
+        end_time=datetime(2022, 1, 24, 12),
+        created_date=created_date,
+    )
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    queue = PollQueue(60, 1800, 6000)
+    queue.sync({KEY: datetime.now() + timedelta(days=1)}, now=0)
+    monkeypatch.setattr(watcher, "queue", queue)
+    return queue
+
+
+def poll_once(plan, slots, seen_at):
+    doctors_info = {(1, 1): [{"id": 1000, "complexResource": [{"id": 5}]}]}
+
+    def poll(calls):
+        assert not calls
+        return {}
+
+    return watcher.poll_plan(plan, doctors_info, {RESOURCE: slots}, poll, seen_at)
+
+
+def matched(matches):
+    return {(watch.id, slot.hour) for watch, slot in matches}
+
+
+def test_doctors_info_falls_back_to_the_next_patient_of_the_group(queue):
+    # patient 1 cannot see the doctor, the call for patient 2 fails, and
+    # patient 3's list has it
+    created = datetime(2022, 1, 19)
+    waiting = [
+        make_watch(id, created, user_id=user_id)
+        for id, user_id in enumerate((1, 2, 2, 3), 1)
+    ]
+    doctors = {
+        (1, 1): [{"id": 1001, "complexResource": [{"id": 6}]}],
+        (1, 3): [{"id": 1000, "complexResource": [{"id": 5}]}],
+    }
+    rounds = []
+
+    def poll(calls):
+        rounds.append(
+            {key: params["oms_number"][0] for key, (_, params) in calls.items()}
+        )
+        return {
+            key: doctors.get(key) if key in doctors else [SLOT_10]
+            for key in calls
+            if key != (1, 2)
+        }
+
+    _, matches, _ = watcher.poll_plan(
+        {KEY: waiting}, {}, {}, poll, datetime(2022, 1, 20)
+    )
+    assert rounds == [{(1, 1): "1"}, {(1, 2): "2"}, {(1, 3): "3"}, {RESOURCE: "3"}]
+    assert matched(matches) == {(1, 10), (2, 10), (3, 10), (4, 10)}
+
+
+def test_watches_seen_before_match_only_new_slots(queue):
+    first = datetime(2022, 1, 20)
+    old = make_watch(1, datetime(2022, 1, 19))
+    _, matches, updates = poll_once({KEY: [old]}, [SLOT_10], first)
+    assert matched(matches) == {(1, 10)}
+    updates[KEY].apply()
+
+    # 08:00 appeared since the last poll; a watch created after it sees
+    # every slot, the old one only the new slot
+    new = make_watch(2, datetime(2022, 1, 20, 12))
+    _, matches, updates = poll_once(
+        {KEY: [old, new]}, [SLOT_8, SLOT_10], datetime(2022, 1, 21)
+    )
+    assert matched(matches) == {(1, 8), (2, 8)}
+    assert updates[KEY].changed
+
+
+def test_known_watches_do_not_match_old_slots_again(queue):
+    old = make_watch(1, datetime(2022, 1, 19))
+    _, _, updates = poll_once({KEY: [old]}, [SLOT_10], datetime(2022, 1, 20))
+    updates[KEY].apply()
+    _, matches, updates = poll_once({KEY: [old]}, [SLOT_10], datetime(2022, 1, 21))
+    assert matches == []
+    assert not updates[KEY].changed
+
+
+def test_slots_of_an_unapplied_poll_stay_new(queue):
+    old = make_watch(1, datetime(2022, 1, 19))
+    _, _, updates = poll_once({KEY: [old]}, [], datetime(2022, 1, 20))
+    updates[KEY].apply()
+    # the tick that saw 10:00 failed to commit its matches
+    _, matches, _ = poll_once({KEY: [old]}, [SLOT_10], datetime(2022, 1, 21))
+    assert matched(matches) == {(1, 10)}
+    _, matches, _ = poll_once({KEY: [old]}, [SLOT_10], datetime(2022, 1, 22))
+    assert matched(matches) == {(1, 10)}
+
+
+def test_apply_matches_notifies_only_the_watches_it_flips(database):
+    start_time = datetime.now() + timedelta(days=1)
+    for available_resource_id in (1000, 1001, 1002):
+        database.session.add(
+            Appointment(
+                available_resource_id=available_resource_id,
+                speciality_id=1,
+                doctor=f"Врач {available_resource_id}",
+                start_time=start_time,
+                end_time=start_time + timedelta(hours=2),
+                user_id=1,
+            )
+        )
+    database.session.commit()
+    watches = watcher.active_watches().all()
+    slot = start_time + timedelta(hours=1)
+
+    # since the watches were read, one was deleted and one matched elsewhere
+    Appointment.query.filter_by(id=watches[0].id).delete()
+    Appointment.query.filter_by(id=watches[1].id).update(
+        {"status": False, "matched_date": datetime(2030, 1, 1)}
+    )
+    database.session.commit()
+
+    applied = watcher.apply_matches([(watch, slot) for watch in watches])
+    assert [watch.id for watch, _ in applied] == [watches[2].id]
+    assert [row.appointment_id for row in Notification.query] == [watches[2].id]
+    assert Appointment.query.get(watches[2].id).matched_slot == slot